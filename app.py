@@ -1,16 +1,28 @@
 #!/usr/bin/env python3
 import os
-import sys
 import json
-import subprocess
-import importlib.util
+import hashlib
+import mmap
 import time
-from datetime import datetime, timedelta
-from flask import Flask, render_template, jsonify, redirect, url_for, flash, request
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from functools import lru_cache
+from itertools import islice
+from datetime import date, datetime, timedelta
+from jinja2 import FileSystemBytecodeCache
+from flask import Flask, Response, render_template, jsonify, redirect, url_for, flash, request, send_file, session, make_response
 from math import ceil
 from dotenv import load_dotenv
 from urllib.parse import quote
 
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; fall back to the stdlib parser/encoder
+    orjson = None
+
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 
 from urllib.parse import unquote
@@ -26,6 +38,15 @@ except ImportError:
     HAS_SCHEDULER = False
     print("Warning: APScheduler not available. Background updates disabled.")
 
+# The updater is loaded once per process (shared with the scheduler) so
+# /refresh can run it in-process instead of spawning a new interpreter
+from trakt_updater import UPDATER
+
+# Background refreshes started from the web UI, keyed by username
+REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='refresh')
+REFRESH_STATUS = {}
+REFRESH_LOCK = threading.Lock()
+
 # Multi-user configuration
 PRIMARY_USER = os.getenv('PRIMARY_USER')
 if not PRIMARY_USER:
@@ -33,29 +54,41 @@ if not PRIMARY_USER:
 ADDITIONAL_USERS_STR = os.getenv('ADDITIONAL_USERS', '')
 ADDITIONAL_USERS = [u.strip() for u in ADDITIONAL_USERS_STR.split(',') if u.strip()]
 ALL_USERS = [PRIMARY_USER] + ADDITIONAL_USERS
+ALL_USERS_SET = frozenset(ALL_USERS)
 
 DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '_data'))
 CACHE_DURATION = int(os.getenv('CACHE_DURATION', 3600))
 
+# Part of every ETag so pages cached by browsers are revalidated after a restart/deploy
+_BOOT_ID = str(time.time_ns())
 
-@APP.template_filter('clean_url')
-def clean_url_filter(endpoint, **kwargs):
-    """Build path-based URLs like /genre/action/actor/Tom instead of ?genre=action&actor=Tom"""
+
+# Order matters for clean URLs - define the order we want
+_URL_PARAM_ORDER = ('view', 'user', 'genre', 'actor', 'search', 'media', 'period', 'year', 'rated', 'page', 'per_page')
+
+# Defaults to skip
+_URL_DEFAULTS = {
+    'page': 1,
+    'per_page': 10,
+    'media': 'both',
+    'period': 'all',
+    'view': 'gallery',
+    'user': PRIMARY_USER
+}
+_KNOWN_KEYS = frozenset(_URL_PARAM_ORDER)
+
+# Accepted values for the enumerated filters
+_MEDIA_VALID = frozenset({'both', 'movies', 'series'})
+_PERIOD_VALID = frozenset({'all', 'week', 'month', 'year'})
+_RATED_VALID = frozenset({'yes', 'no', ''})
+_VIEW_VALID = frozenset({'gallery', 'calendar'})
+# Item type selected by the media filter ('series' means episode entries)
+_MEDIA_TYPES = {'movies': 'movie', 'series': 'episode'}
+
+
+def _build_clean_url(kwargs):
     # Build path segments from parameters
     segments = []
-    
-    # Order matters for clean URLs - define the order we want
-    param_order = ['view', 'user', 'genre', 'actor', 'search', 'media', 'period', 'year', 'rated', 'page', 'per_page']
-    
-    # Defaults to skip
-    defaults = {
-        'page': 1,
-        'per_page': 10,
-        'media': 'both',
-        'period': 'all',
-        'view': 'gallery',
-        'user': PRIMARY_USER
-    }
 
     # If a non-primary user is selected, prefix the URL with /<username>
     user_segment = None
@@ -63,12 +96,12 @@ def clean_url_filter(endpoint, **kwargs):
     if user_value and user_value != PRIMARY_USER:
         user_segment = quote(str(user_value), safe='')
     
-    for param in param_order:
+    for param in _URL_PARAM_ORDER:
         if param not in kwargs:
             continue
         value = kwargs[param]
         # Skip empty, None, or default values
-        if value is None or value == '' or (param in defaults and value == defaults[param]):
+        if value is None or value == '' or (param in _URL_DEFAULTS and value == _URL_DEFAULTS[param]):
             continue
         # 'user' handled as leading segment
         if param == 'user':
@@ -86,8 +119,35 @@ def clean_url_filter(endpoint, **kwargs):
     return '/'
 
 
+@lru_cache(maxsize=4096)
+def _clean_url_cached(params):
+    return _build_clean_url(dict(params))
+
+
+@APP.template_filter('clean_url')
+def clean_url_filter(endpoint, **kwargs):
+    """Build path-based URLs like /genre/action/actor/Tom instead of ?genre=action&actor=Tom"""
+    # Templates call this for every card and pager link with a small set of
+    # distinct argument combinations, so memoize on the kwargs.
+    try:
+        return _clean_url_cached(frozenset(kwargs.items()))
+    except TypeError:
+        # unhashable value; build without the cache
+        return _build_clean_url(kwargs)
+
+
 APP.jinja_env.globals['clean_url'] = clean_url_filter
 
+# Persist compiled templates across restarts: the first render after a
+# restart loads index.html's bytecode from disk instead of compiling it.
+# Templates are only re-checked for changes when running with FLASK_DEBUG=1.
+JINJA_CACHE_DIR = os.path.join(DATA_DIR, 'jinja_cache')
+try:
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    APP.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+except OSError as e:
+    print(f"Warning: template bytecode cache disabled: {e}")
+
 
 def get_user_data_path(username: str = None):
     """Get the data path for a given user. If username is None, uses primary user."""
@@ -104,13 +164,202 @@ def get_user_raw_path(username: str = None):
     return os.path.join(DATA_DIR, f'trakt_raw_{username}.json')
 
 
+def _json_load(path):
+    """Parse a JSON file, using orjson when it is installed."""
+    if orjson is None:
+        with open(path, 'rb') as f:
+            return json.load(f)
+    # orjson can parse straight from a read-only mapping of the file, which
+    # saves copying the whole file into a bytes object first
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return orjson.loads(b'')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as view:
+                return orjson.loads(view)
+
+
+def _json_response(obj):
+    """Serialize obj to a JSON response, using orjson when it is installed."""
+    if orjson is None:
+        return jsonify(obj)
+    return Response(orjson.dumps(obj), mimetype='application/json')
+
+
+def _make_etag(*parts):
+    return hashlib.md5('|'.join(map(str, (_BOOT_ID,) + parts)).encode()).hexdigest()
+
+
+def _not_modified(etag):
+    """Return a 304 response if the client already holds etag, else None."""
+    if not request.if_none_match.contains(etag):
+        return None
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    return resp
+
+
+def _parse_watched(item):
+    watched = item.get('watched_at')
+    # Rule out missing/short values up front instead of letting strptime
+    # raise; 'Y-M-D H:M' needs at least 12 characters even without padding
+    if not isinstance(watched, str) or len(watched) < 12:
+        return None
+    try:
+        # Parse YYYY-MM-DD HH:MM format
+        return datetime.strptime(watched, '%Y-%m-%d %H:%M')
+    except ValueError:
+        return None
+
+
+def _format_generated_at(s):
+    """Format generated_at to a human-readable local time."""
+    if not s:
+        return None
+    try:
+        # Handle ISO format with Z or timezone
+        if isinstance(s, str):
+            # Replace Z with +00:00 for Python's fromisoformat
+            s = s.replace('Z', '+00:00')
+            # Handle fractional seconds if present
+            if '.' in s and '+' in s:
+                # Split on + to separate datetime from timezone
+                dt_part, tz_part = s.rsplit('+', 1)
+                # Limit fractional seconds to 6 digits
+                if '.' in dt_part:
+                    base, frac = dt_part.split('.')
+                    frac = frac[:6]
+                    s = f"{base}.{frac}+{tz_part}"
+            dt = datetime.fromisoformat(s)
+        else:
+            dt = s
+        # Convert to local timezone
+        local_dt = dt.astimezone()
+        return local_dt.strftime('%B %d, %Y at %I:%M %p')
+    except Exception:
+        return s
+
+
+def _lower_set(values):
+    return frozenset(v.lower() for v in values or () if isinstance(v, str))
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else ()
+
+
+def compute_stats(items):
+    """Return (stats, available_years) for a list of history items."""
+    # Let Counter do the counting in C rather than incrementing per item
+    actor_counter = Counter(a for it in items for a in _as_list(it.get('cast')) if a)
+    genre_counter = Counter(g for it in items for g in _as_list(it.get('genres')) if g)
+    # Release year, not watch year
+    year_counter = Counter(it['year'] for it in items if it.get('year'))
+    type_counter = Counter(it.get('type') for it in items)
+    total_movies = type_counter['movie']
+    total_episodes = type_counter['episode']
+    total_runtime = sum(it.get('runtime', 0) or 0 for it in items)
+    ratings = [it['rating'] for it in items if it.get('rating') is not None]
+    rating_sum = sum(ratings)
+    rated_count = len(ratings)
+
+    stats = {
+        'total_hours': round(total_runtime / 60, 1) if total_runtime else 0,
+        'total_days': round(total_runtime / 60 / 24, 1) if total_runtime else 0,
+        'total_movies': total_movies,
+        'total_episodes': total_episodes,
+        'top_actor': actor_counter.most_common(1)[0] if actor_counter else None,
+        'top_genre': genre_counter.most_common(1)[0] if genre_counter else None,
+        'top_year': year_counter.most_common(1)[0] if year_counter else None,
+        'avg_rating': round(rating_sum / rated_count, 1) if rated_count else None,
+        'rated_count': rated_count,
+    }
+    available_years = sorted(year_counter, reverse=True)
+    return stats, available_years
+
+
+def build_lookup(data):
+    """Precompute lowercased filter fields for each item, aligned with data['items'].
+
+    Also holds the unfiltered statistics and year list so they are computed
+    once per data file rather than on every request.
+    """
+    items = data.get('items', [])
+    lookup = {'search_blob': [], 'year_str': [], 'watched_ts': [], 'watched_date': []}
+    by_date = defaultdict(list)
+    by_genre = defaultdict(list)
+    by_actor = defaultdict(list)
+    by_year = defaultdict(list)
+    for pos, it in enumerate(items):
+        show = it.get('show')
+        show_title = show.get('title') if it.get('type') == 'episode' and show else None
+        cast_lc = _lower_set(it.get('cast'))
+        # Title, show title and cast in one lowercased string, one per line,
+        # so a search is a single substring test
+        lookup['search_blob'].append('\n'.join([(it.get('title') or '').lower(), (show_title or '').lower(), *cast_lc]))
+        lookup['year_str'].append(str(it['year']) if it.get('year') else None)
+        for g in _lower_set(it.get('genres')):
+            by_genre[g].append(pos)
+        for a in cast_lc:
+            by_actor[a].append(pos)
+        if isinstance(it.get('year'), int):
+            by_year[it['year']].append(pos)
+        watched = _parse_watched(it)
+        lookup['watched_ts'].append(watched.timestamp() if watched else None)
+        watched_date = it['watched_at'].split(' ')[0] if it.get('watched_at') else 'Unknown'
+        lookup['watched_date'].append(watched_date)
+        by_date[watched_date].append(pos)
+    # Calendar view: dates most recent first, each with its item positions
+    lookup['dates'] = sorted(by_date, reverse=True)
+    lookup['by_date'] = by_date
+    # Inverted indexes for the genre/actor/release year filters
+    lookup['by_genre'] = by_genre
+    lookup['by_actor'] = by_actor
+    lookup['by_year'] = by_year
+    # Period filter: positions ordered by watch time (most recent first) and
+    # the matching negated timestamps, ascending, for bisect
+    watched_ts = lookup['watched_ts']
+    ts_order = sorted((i for i, ts in enumerate(watched_ts) if ts is not None),
+                      key=lambda i: watched_ts[i], reverse=True)
+    lookup['ts_order'] = ts_order
+    lookup['neg_ts'] = [-watched_ts[i] for i in ts_order]
+    lookup['stats'], lookup['available_years'] = compute_stats(items)
+    lookup['generated_at_fmt'] = _format_generated_at(data.get('generated_at'))
+    return lookup
+
+
+# Parsed history files keyed by path; an entry is reused until the file's
+# mtime or size changes (i.e. the updater rewrote it).
+_DATA_CACHE = {}
+# /raw previews ({count, first}) keyed the same way
+_RAW_PREVIEW_CACHE = {}
+
+
+def load_history(username: str = None):
+    """Load history data for a user together with its filter lookup."""
+    data_path = get_user_data_path(username)
+    try:
+        st = os.stat(data_path)
+    except FileNotFoundError:
+        empty = {'generated_at': None, 'count': 0, 'items': []}
+        return empty, build_lookup(empty)
+
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _DATA_CACHE.get(data_path)
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+
+    data = _json_load(data_path)
+    lookup = build_lookup(data)
+    _DATA_CACHE[data_path] = (version, data, lookup)
+    return data, lookup
+
+
 def load_data(username: str = None):
     """Load history data for specified user (or primary user if None)."""
-    data_path = get_user_data_path(username)
-    if not os.path.exists(data_path):
-        return {'generated_at': None, 'count': 0, 'items': []}
-    with open(data_path, 'r') as f:
-        return json.load(f)
+    return load_history(username)[0]
 
 
 @APP.route('/')
@@ -121,19 +370,14 @@ def index(params=None):
     
     if params:
         parts = params.split('/')
-        known_keys = {'view', 'user', 'genre', 'actor', 'search', 'media', 'period', 'year', 'rated', 'page', 'per_page'}
 
         # Support /<username> and /<username>/param/value
-        if parts and parts[0] in ALL_USERS and parts[0] not in known_keys:
+        if parts and parts[0] in ALL_USERS_SET and parts[0] not in _KNOWN_KEYS:
             args['user'] = parts[0]
             parts = parts[1:]
 
-        # Parse pairs: param/value
-        for i in range(0, len(parts) - 1, 2):
-            if i + 1 < len(parts):
-                key = parts[i]
-                value = unquote(parts[i + 1])  # URL decode the value
-                args[key] = value
+        # Parse pairs: param/value (URL decode the values)
+        args.update((k, unquote(v)) for k, v in zip(parts[::2], parts[1::2]) if k in _KNOWN_KEYS)
     
     # Merge with query string args (fallback for old URLs)
     for key in request.args:
@@ -142,10 +386,26 @@ def index(params=None):
     
     # Get selected user (default to primary user)
     selected_user = args.get('user', PRIMARY_USER)
-    if selected_user not in ALL_USERS:
+    if selected_user not in ALL_USERS_SET:
         selected_user = PRIMARY_USER
     
-    data = load_data(selected_user)
+    # The page only depends on the data file, the URL and (for the period
+    # filter) today's date. Pending flash messages must always be rendered.
+    data_path = get_user_data_path(selected_user)
+    try:
+        data_mtime = os.path.getmtime(data_path)
+    except OSError:
+        data_mtime = None
+    _flash_refresh_result(selected_user)
+    has_flashes = '_flashes' in session
+    refresh_running = _refresh_running(selected_user)
+    etag = _make_etag(data_mtime, date.today(), request.full_path, refresh_running)
+    if not has_flashes:
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+    data, lookup = load_history(selected_user)
     # pagination params
     try:
         page = max(1, int(args.get('page', 1)))
@@ -176,13 +436,13 @@ def index(params=None):
     # optional media filter: 'both' (default), 'movies', 'series'
     media = args.get('media', 'both') or 'both'
     media = media.strip().lower()
-    if media not in ('both', 'movies', 'series'):
+    if media not in _MEDIA_VALID:
         media = 'both'
 
     # optional time-period filter: 'all', 'week', 'month', 'year'
     period = args.get('period', 'all') or 'all'
     period = period.strip().lower()
-    if period not in ('all', 'week', 'month', 'year'):
+    if period not in _PERIOD_VALID:
         period = 'all'
 
     # optional release year filter
@@ -192,168 +452,130 @@ def index(params=None):
     # optional rated only filter
     rated_only = args.get('rated', '') or ''
     rated_only = rated_only.strip().lower()
-    if rated_only not in ('yes', 'no', ''):
+    if rated_only not in _RATED_VALID:
         rated_only = ''
     
     # optional view mode: 'gallery' (default) or 'calendar'
     view_mode = args.get('view', 'gallery') or 'gallery'
     view_mode = view_mode.strip().lower()
-    if view_mode not in ('gallery', 'calendar'):
+    if view_mode not in _VIEW_VALID:
         view_mode = 'gallery'
 
-    # Filter items by genre when requested (case-insensitive match)
-    items_all = data.get('items', [])
-    if genre:
-        def _match_genre(item):
-            gs = item.get('genres') or []
-            try:
-                return any(g.lower() == genre.lower() for g in gs)
-            except Exception:
-                return False
-        items_all = [it for it in items_all if _match_genre(it)]
+    # Release year, watch period, genre and actor are answered from the
+    # precomputed indexes: each gives the positions of the items it matches,
+    # and the candidates are their intersection. The remaining filters are
+    # predicates applied in a single sweep over the candidate positions
+    # (or all items when no indexed filter is active).
+    all_items = data.get('items', [])
+    hits = []
+    preds = []
 
-    # Filter by actor when requested (case-insensitive match)
-    if actor:
-        def _match_actor(item):
-            cast = item.get('cast') or []
-            try:
-                return any(a.lower() == actor.lower() for a in cast)
-            except Exception:
-                return False
-        items_all = [it for it in items_all if _match_actor(it)]
-
-    # Filter by search query (searches title, actors, and year)
-    if search:
-        def _match_search(item):
-            search_lower = search.lower()
-            # Search in title
-            title = item.get('title', '').lower()
-            if search_lower in title:
-                return True
-            # Search in show title (for episodes)
-            if item.get('type') == 'episode' and item.get('show'):
-                show_title = item.get('show', {}).get('title', '').lower()
-                if search_lower in show_title:
-                    return True
-            # Search in actors
-            cast = item.get('cast') or []
-            for actor_name in cast:
-                if search_lower in actor_name.lower():
-                    return True
-            # Search by year (exact match)
-            year = item.get('year')
-            if year and str(year) == search:
-                return True
-            return False
-        items_all = [it for it in items_all if _match_search(it)]
-
-    # Filter by media type when requested
-    if media == 'movies':
-        items_all = [it for it in items_all if (it.get('type') == 'movie')]
-    elif media == 'series':
-        # 'series' here means episode entries
-        items_all = [it for it in items_all if (it.get('type') == 'episode')]
-
-    # Filter by time period when requested
+    wanted_type = _MEDIA_TYPES.get(media)
+    if wanted_type and rated_only == 'yes':
+        preds.append(lambda i: all_items[i].get('type') == wanted_type and all_items[i].get('rating') is not None)
+    elif wanted_type:
+        preds.append(lambda i: all_items[i].get('type') == wanted_type)
+    elif rated_only == 'yes':
+        preds.append(lambda i: all_items[i].get('rating') is not None)
+
+    # Filter by release year when requested
+    if release_year:
+        try:
+            hits.append(lookup['by_year'].get(int(release_year), ()))
+        except ValueError:
+            pass  # ignore invalid year input
+
+    # Filter by time period when requested: binary-search the cutoff in the
+    # watch-time ordering and keep the items watched after it
     if period != 'all':
         now = datetime.now()
-        
-        def _parse_watched(item):
-            watched = item.get('watched_at')
-            if not watched:
-                return None
-            try:
-                # Parse YYYY-MM-DD HH:MM format
-                return datetime.strptime(watched, '%Y-%m-%d %H:%M')
-            except Exception:
-                return None
-        
         if period == 'week':
             # Current week (Monday to Sunday)
-            start_of_week = now - timedelta(days=now.weekday())
-            start_of_week = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
-            items_all = [it for it in items_all if _parse_watched(it) and _parse_watched(it) >= start_of_week]
+            period_start = now - timedelta(days=now.weekday())
+            period_start = period_start.replace(hour=0, minute=0, second=0, microsecond=0)
         elif period == 'month':
             # Current month
-            start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            items_all = [it for it in items_all if _parse_watched(it) and _parse_watched(it) >= start_of_month]
-        elif period == 'year':
+            period_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        else:
             # Current year
-            start_of_year = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-            items_all = [it for it in items_all if _parse_watched(it) and _parse_watched(it) >= start_of_year]
+            period_start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        k = bisect_right(lookup['neg_ts'], -period_start.timestamp())
+        hits.append(lookup['ts_order'][:k])
 
-    # Filter by release year when requested
-    if release_year:
-        try:
-            year_int = int(release_year)
-            items_all = [it for it in items_all if it.get('year') == year_int]
-        except ValueError:
-            pass  # ignore invalid year input
-
-    # Filter by rated only when requested
-    if rated_only == 'yes':
-        items_all = [it for it in items_all if it.get('rating') is not None]
+    # Filter items by genre when requested (case-insensitive match)
+    if genre:
+        hits.append(lookup['by_genre'].get(genre.lower(), ()))
 
-    total = len(items_all)
-    total_pages = max(1, ceil(total / per_page))
-    if page > total_pages:
-        page = total_pages
+    # Filter by actor when requested (case-insensitive match)
+    if actor:
+        hits.append(lookup['by_actor'].get(actor.lower(), ()))
 
-    start = (page - 1) * per_page
-    end = start + per_page
-    items = items_all[start:end]
+    # Filter by search query (searches title, show title, actors, and year)
+    if search:
+        search_lc = search.lower()
+        search_blob = lookup['search_blob']
+        year_str = lookup['year_str']
+        # Search by year is an exact match
+        preds.append(lambda i: search_lc in search_blob[i] or year_str[i] == search)
+
+    # Positions of the items passing every filter (None = no filter active)
+    matched = None
+    if hits:
+        hits.sort(key=len)
+        candidates = set(hits[0])
+        for h in hits[1:]:
+            candidates.intersection_update(h)
+        matched = sorted(candidates)
+    if preds:
+        if matched is None:
+            matched = range(len(all_items))
+        matched = [i for i in matched if all(p(i) for p in preds)]
 
-    # Format generated_at to human-readable format
-    def _format_generated_at(s):
-        if not s:
-            return None
-        try:
-            # Handle ISO format with Z or timezone
-            if isinstance(s, str):
-                # Replace Z with +00:00 for Python's fromisoformat
-                s = s.replace('Z', '+00:00')
-                # Handle fractional seconds if present
-                if '.' in s and '+' in s:
-                    # Split on + to separate datetime from timezone
-                    dt_part, tz_part = s.rsplit('+', 1)
-                    # Limit fractional seconds to 6 digits
-                    if '.' in dt_part:
-                        base, frac = dt_part.split('.')
-                        frac = frac[:6]
-                        s = f"{base}.{frac}+{tz_part}"
-                dt = datetime.fromisoformat(s)
-            else:
-                dt = s
-            # Convert to local timezone
-            local_dt = dt.astimezone()
-            return local_dt.strftime('%B %d, %Y at %I:%M %p')
-        except Exception:
-            return s
-
-    # For calendar mode, group items by date and paginate by date
     calendar_items = None
+    items = []
     if view_mode == 'calendar':
-        from collections import defaultdict
-        calendar_items_dict = defaultdict(list)
-        for it in items_all:
-            watched_date = (it.get('watched_at') or '').split(' ')[0] if it.get('watched_at') else 'Unknown'
-            calendar_items_dict[watched_date].append(it)
-        # Sort dates in reverse (most recent first)
-        sorted_dates = sorted(calendar_items_dict.keys(), reverse=True)
-        
+        # Group items by watch date and paginate by date. The date -> items
+        # grouping of the whole history is precomputed in build_lookup().
+        by_date = lookup['by_date']
+        if matched is None:
+            total = len(lookup['dates'])
+        else:
+            matched_set = set(matched)
+            watched_date = lookup['watched_date']
+            present = {watched_date[i] for i in matched}
+            total = len(present)
+
         # Paginate by date
-        total = len(sorted_dates)
         total_pages = max(1, ceil(total / per_page))
         if page > total_pages:
             page = total_pages
         start = (page - 1) * per_page
         end = start + per_page
-        paginated_dates = sorted_dates[start:end]
-        
-        calendar_items = {date: calendar_items_dict[date] for date in paginated_dates}
-    
+        if matched is None:
+            paginated_dates = lookup['dates'][start:end]
+        else:
+            # Walk the sorted dates lazily and stop after the visible page
+            paginated_dates = list(islice((d for d in lookup['dates'] if d in present), start, end))
+
+        if matched is None:
+            calendar_items = {d: [all_items[i] for i in by_date[d]] for d in paginated_dates}
+        else:
+            calendar_items = {d: [all_items[i] for i in by_date[d] if i in matched_set] for d in paginated_dates}
+    else:
+        total = len(all_items) if matched is None else len(matched)
+        total_pages = max(1, ceil(total / per_page))
+        if page > total_pages:
+            page = total_pages
+
+        start = (page - 1) * per_page
+        end = start + per_page
+        if matched is None:
+            items = all_items[start:end]
+        else:
+            items = [all_items[i] for i in matched[start:end]]
+
     paged = {
-        'generated_at': _format_generated_at(data.get('generated_at')),
+        'generated_at': lookup['generated_at_fmt'],
         'generation_time': data.get('generation_time'),
         'count': total,
         'items': items,
@@ -373,149 +595,178 @@ def index(params=None):
 
     per_page_options = [10, 25, 50, 100]
     
-    # Get unique years from all items for the year dropdown
-    all_years = set()
-    for it in data.get('items', []):
-        if it.get('year'):
-            all_years.add(it.get('year'))
-    available_years = sorted(all_years, reverse=True)
-    
-    # Calculate statistics from all items (unfiltered)
-    all_items = data.get('items', [])
-    stats = {}
-    
-    # Total watch time (sum of all runtimes)
-    total_runtime = sum(it.get('runtime', 0) or 0 for it in all_items)
-    stats['total_hours'] = round(total_runtime / 60, 1) if total_runtime else 0
-    stats['total_days'] = round(total_runtime / 60 / 24, 1) if total_runtime else 0
-    
-    # Count movies vs episodes
-    stats['total_movies'] = sum(1 for it in all_items if it.get('type') == 'movie')
-    stats['total_episodes'] = sum(1 for it in all_items if it.get('type') == 'episode')
-    
-    # Most watched actor (from cast arrays)
-    from collections import Counter
-    actor_counter = Counter()
-    for it in all_items:
-        cast = it.get('cast', [])
-        if isinstance(cast, list):
-            for actor in cast:
-                if actor:
-                    actor_counter[actor] += 1
-    stats['top_actor'] = actor_counter.most_common(1)[0] if actor_counter else None
-    
-    # Most watched genre
-    genre_counter = Counter()
-    for it in all_items:
-        genres = it.get('genres', [])
-        if isinstance(genres, list):
-            for genre in genres:
-                if genre:
-                    genre_counter[genre] += 1
-    stats['top_genre'] = genre_counter.most_common(1)[0] if genre_counter else None
-    
-    # Year with most watches (release year, not watch year)
-    year_counter = Counter()
-    for it in all_items:
-        year = it.get('year')
-        if year:
-            year_counter[year] += 1
-    stats['top_year'] = year_counter.most_common(1)[0] if year_counter else None
-    
-    # Average rating
-    ratings = [it.get('rating') for it in all_items if it.get('rating') is not None]
-    stats['avg_rating'] = round(sum(ratings) / len(ratings), 1) if ratings else None
-    stats['rated_count'] = len(ratings)
+    # Statistics and the year dropdown cover all items (unfiltered) and are
+    # computed once per data file version in build_lookup()
+    stats = lookup['stats']
+    available_years = lookup['available_years']
 
     ratings_note = None
     if selected_user != PRIMARY_USER:
         ratings_note = f"Ratings are only available for primary user ({PRIMARY_USER})."
     
-    return render_template('index.html', data=paged, per_page_options=per_page_options, available_years=available_years, stats=stats,
-                           all_users=ALL_USERS, selected_user=selected_user, primary_user=PRIMARY_USER, ratings_note=ratings_note, view_mode=view_mode)
+    resp = make_response(render_template('index.html', data=paged, per_page_options=per_page_options, available_years=available_years, stats=stats,
+                                         all_users=ALL_USERS, selected_user=selected_user, primary_user=PRIMARY_USER, ratings_note=ratings_note, view_mode=view_mode,
+                                         refresh_running=refresh_running))
+    # Always revalidate; a matching ETag then costs a 304 instead of a render
+    resp.cache_control.no_cache = True
+    if not has_flashes:
+        resp.set_etag(etag)
+        if data_mtime is not None:
+            resp.last_modified = data_mtime
+    return resp
 
 
 @APP.route('/api/history')
 def api_history():
     selected_user = request.args.get('user', PRIMARY_USER)
-    if selected_user not in ALL_USERS:
+    if selected_user not in ALL_USERS_SET:
         selected_user = PRIMARY_USER
-    data = load_data(selected_user)
-    return jsonify(data)
+    data_path = get_user_data_path(selected_user)
+    if not os.path.exists(data_path):
+        return _json_response({'generated_at': None, 'count': 0, 'items': []})
+    # The file on disk is already the response payload: stream it instead of
+    # re-serializing the parsed copy (conditional=True also answers 304s).
+    # The updater also writes a gzip copy; hand that out as-is to clients
+    # that accept it, as long as it is not older than the JSON file. The
+    # quality is checked, not membership: 'gzip;q=0' explicitly refuses it.
+    # Both responses carry Vary: Accept-Encoding for intermediate caches.
+    gz_path = data_path + '.gz'
+    if request.accept_encodings['gzip'] > 0:
+        try:
+            if os.stat(gz_path).st_mtime >= os.stat(data_path).st_mtime:
+                resp = send_file(gz_path, mimetype='application/json', conditional=True)
+                resp.headers['Content-Encoding'] = 'gzip'
+                resp.vary.add('Accept-Encoding')
+                return resp
+        except OSError:
+            pass
+    resp = send_file(data_path, mimetype='application/json', conditional=True)
+    resp.vary.add('Accept-Encoding')
+    return resp
 
 
 @APP.route('/raw')
 def raw():
     """Return the raw cached Trakt response (first item) for debugging."""
     selected_user = request.args.get('user', PRIMARY_USER)
-    if selected_user not in ALL_USERS:
+    if selected_user not in ALL_USERS_SET:
         selected_user = PRIMARY_USER
     raw_path = get_user_raw_path(selected_user)
-    if not os.path.exists(raw_path):
+    try:
+        st = os.stat(raw_path)
+    except FileNotFoundError:
         return jsonify({'error': 'raw cache not found', 'path': raw_path}), 404
     try:
-        with open(raw_path, 'r') as f:
-            raw = json.load(f)
-        # return first item and total count for quick inspection
-        return jsonify({'count': len(raw), 'first': raw[0] if raw else None})
+        version = (st.st_mtime_ns, st.st_size)
+        etag = _make_etag(raw_path, *version)
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+        cached = _RAW_PREVIEW_CACHE.get(raw_path)
+        if cached and cached[0] == version:
+            preview = cached[1]
+        else:
+            raw = _json_load(raw_path)
+            # return first item and total count for quick inspection
+            preview = {'count': len(raw), 'first': raw[0] if raw else None}
+            _RAW_PREVIEW_CACHE[raw_path] = (version, preview)
+        resp = _json_response(preview)
+        resp.cache_control.no_cache = True
+        resp.set_etag(etag)
+        resp.last_modified = st.st_mtime
+        return resp
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def _refresh_running(username):
+    status = REFRESH_STATUS.get(username)
+    return bool(status) and status['state'] == 'running'
+
+
+def _flash_refresh_result(username):
+    """Flash the outcome of a finished background refresh once."""
+    # Checked and marked under the lock so concurrent requests flash it only once
+    with REFRESH_LOCK:
+        status = REFRESH_STATUS.get(username)
+        if not status or status['state'] == 'running' or status['reported']:
+            return
+        status['reported'] = True
+    if status['state'] == 'done':
+        flash(f'Refresh completed successfully for {username}', 'success')
+    else:
+        flash(f'Refresh failed: {status["error"]}', 'error')
+
+
+def _run_refresh(username):
+    status = REFRESH_STATUS[username]
+    result = {}
+    try:
+        # Incremental updates are fast and ratings are always fetched fresh on every run
+        UPDATER.run_update_for_user(username)
+        result = {'state': 'done'}
+    except (Exception, SystemExit) as e:
+        # The updater reports fatal errors through SystemExit
+        result = {'state': 'failed', 'error': str(e)[:1000]}
+    finally:
+        # Published in one step under the lock the request side reads it with
+        with REFRESH_LOCK:
+            status.update(result, finished_at=time.time())
+
+
 @APP.route('/refresh')
 def refresh():
     # Get selected user (default to primary user)
     selected_user = request.args.get('user', PRIMARY_USER)
-    if selected_user not in ALL_USERS:
+    if selected_user not in ALL_USERS_SET:
         selected_user = PRIMARY_USER
     
     # Prefer running the centralized updater script to ensure consistent
     # season-resolution and normalization. This keeps resolver logic in one place.
-    updater = os.path.join(os.path.dirname(__file__), 'scripts', 'update_trakt_local.py')
-    if not os.path.exists(updater):
+    if UPDATER is None:
         flash('Updater script not found: scripts/update_trakt_local.py', 'error')
         return redirect(url_for('index', user=selected_user))
 
     # Check data freshness
     data_path = get_user_data_path(selected_user)
     try:
-        if os.path.exists(data_path):
-            mtime = os.path.getmtime(data_path)
-            age = time.time() - mtime
-            if age < CACHE_DURATION:
-                flash(f'Data is fresh (updated {int(age)}s ago). Skipping refresh.', 'success')
+        try:
+            age = time.time() - os.stat(data_path).st_mtime
+        except FileNotFoundError:
+            age = None
+        if age is not None and age < CACHE_DURATION:
+            flash(f'Data is fresh (updated {int(age)}s ago). Skipping refresh.', 'success')
+            return redirect(url_for('index', user=selected_user))
+
+        # Run the updater in the background; the page polls /refresh/status
+        # and reloads once it finishes
+        with REFRESH_LOCK:
+            if _refresh_running(selected_user):
+                flash(f'Refresh already running for {selected_user}', 'success')
                 return redirect(url_for('index', user=selected_user))
-
-        # Run the updater for this user with --no-cast and --no-enrichment for faster web refreshes
-        # Cast fetching and show enrichment require many API calls and can take 5-10+ minutes
-        # Users can run manually with full data: python3 scripts/update_trakt_local.py --user <username>
-        # Increase timeout to 15 minutes for very slow connections
-        venv_python = os.path.join(os.path.dirname(__file__), '.venv', 'bin', 'python')
-        python_exec = sys.executable
-        if not python_exec or not os.path.exists(python_exec):
-            python_exec = venv_python if os.path.exists(venv_python) else 'python3'
-        cmd = [python_exec, updater, '--user', selected_user]
-        # Incremental updates are fast and ratings are always fetched fresh on every run
-        proc = subprocess.run(
-            cmd,
-            cwd=os.path.dirname(__file__), 
-            capture_output=True, 
-            text=True, 
-            timeout=900
-        )
-        if proc.returncode == 0:
-            flash(f'Refresh completed successfully for {selected_user}', 'success')
-        else:
-            msg = proc.stderr.strip() or proc.stdout.strip() or f'return code {proc.returncode}'
-            flash(f'Refresh failed: {msg[:1000]}', 'error')
-    except subprocess.TimeoutExpired:
-        flash('Refresh timed out after 15 minutes. Try running manually: python3 scripts/update_trakt_local.py --user <username>', 'error')
+            REFRESH_STATUS[selected_user] = {'state': 'running', 'error': None, 'reported': False,
+                                             'started_at': time.time(), 'finished_at': None}
+            REFRESH_EXECUTOR.submit(_run_refresh, selected_user)
+        flash(f'Refresh started for {selected_user}', 'success')
     except Exception as e:
         flash(f'Failed to run updater: {e}', 'error')
 
     return redirect(url_for('index', user=selected_user))
 
 
+@APP.route('/refresh/status')
+def refresh_status():
+    selected_user = request.args.get('user', PRIMARY_USER)
+    if selected_user not in ALL_USERS_SET:
+        selected_user = PRIMARY_USER
+    with REFRESH_LOCK:
+        status = dict(REFRESH_STATUS.get(selected_user) or {'state': 'idle', 'error': None,
+                                                            'started_at': None, 'finished_at': None})
+    return _json_response({'user': selected_user, 'state': status['state'], 'error': status['error'],
+                           'started_at': status['started_at'], 'finished_at': status['finished_at']})
+
+
 if __name__ == '__main__':
     # Start background scheduler for automatic updates
     if HAS_SCHEDULER:
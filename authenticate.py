@@ -5,14 +5,10 @@ Run this once to create the trakt.json token file
 """
 import os
 import json
-from dotenv import load_dotenv
 from trakt import Trakt
 
-load_dotenv()
-
-TOKEN_FILE = 'trakt.json'
-CLIENT_ID = os.getenv('TRAKT_CLIENT_ID')
-CLIENT_SECRET = os.getenv('TRAKT_CLIENT_SECRET')
+# Share configuration (.env, token file location) with main.py
+from trakt_auth import TOKEN_FILE, CLIENT_ID, CLIENT_SECRET
 
 def authenticate():
     """Perform initial OAuth authentication with Trakt"""
@@ -7,43 +7,107 @@ Uses single authentication to fetch watch history for multiple users.
 import os
 import json
 import time
+from functools import lru_cache
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from trakt import Trakt
 
-load_dotenv()
-
-# Configuration
-TOKEN_FILE = 'trakt.json'
-CLIENT_ID = os.getenv('TRAKT_CLIENT_ID')
-CLIENT_SECRET = os.getenv('TRAKT_CLIENT_SECRET')
+# Configuration (.env, token file location), shared with authenticate.py
+from trakt_auth import TOKEN_FILE, CLIENT_ID, CLIENT_SECRET
+
+# Shared session for direct Trakt API calls: keeps connections alive and
+# retries rate-limited (429, honouring Retry-After) and 5xx responses.
+# Only GETs are retried: the token refresh POST spends its single-use refresh
+# token, so resending it after a lost response would fail anyway.
+_SESSION = requests.Session()
+_SESSION.headers.update({'Content-Type': 'application/json'})
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    ),
+))
 
 # Export Trakt and CLIENT_ID for use by update_trakt_local.py
-__all__ = ['Trakt', 'CLIENT_ID', 'authenticate']
-
+__all__ = ['Trakt', 'CLIENT_ID', 'authenticate', 'load_token', 'api_headers']
 
-def _token_expired(token_data, skew_seconds=60):
-    """Return True if token is expired (with a small safety skew)."""
-    if not isinstance(token_data, dict):
-        return True
 
+def _token_expires_at(token_data):
+    """Return the token expiry in epoch seconds (0 if unparseable, None if unknown)."""
     expires_at = token_data.get('expires_at')
     if expires_at is not None:
         try:
-            return time.time() >= float(expires_at) - skew_seconds
+            return float(expires_at)
         except (TypeError, ValueError):
-            return True
+            return 0.0
 
     created_at = token_data.get('created_at')
     expires_in = token_data.get('expires_in')
     if created_at is None or expires_in is None:
+        return None
+
+    try:
+        return float(created_at) + float(expires_in)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _token_expired(expires_at, skew_seconds=60):
+    """Return True if a token expiring at expires_at is expired (with a small safety skew)."""
+    if expires_at is None:
         # Missing data; assume not expired to avoid unnecessary failures
         return False
 
+    return time.time() >= expires_at - skew_seconds
+
+
+@lru_cache(maxsize=4)
+def _load_token(path, mtime_ns):
+    """Parse the token file into (token, expires_at). Keyed on its mtime so a rewritten file is re-read.
+
+    The expiry never changes for a given token, so it is computed once here.
+    A token that is not a dict counts as expired.
+    """
+    with open(path, 'r') as f:
+        token_data = json.load(f)
+    expires_at = _token_expires_at(token_data) if isinstance(token_data, dict) else 0.0
+    return token_data, expires_at
+
+
+def _load_token_entry():
+    """Return (token, expires_at) for the stored OAuth token, or None if the token file is missing."""
+    token_path = os.path.abspath(TOKEN_FILE)
     try:
-        return time.time() >= (float(created_at) + float(expires_in) - skew_seconds)
-    except (TypeError, ValueError):
-        return True
+        mtime_ns = os.stat(token_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _load_token(token_path, mtime_ns)
+
+
+def load_token():
+    """Return the stored OAuth token, or None if the token file is missing."""
+    entry = _load_token_entry()
+    return entry[0] if entry else None
+
+
+def api_headers():
+    """Headers for direct Trakt API requests, authorized with the stored token if any."""
+    headers = {
+        'Content-Type': 'application/json',
+        'trakt-api-version': '2',
+        'trakt-api-key': CLIENT_ID,
+    }
+    token_data = load_token()
+    access_token = token_data.get('access_token') if token_data else None
+    if access_token:
+        headers['Authorization'] = f'Bearer {access_token}'
+    return headers
 
 
 def _refresh_token(token_data):
@@ -53,7 +117,7 @@ def _refresh_token(token_data):
         print("Error: refresh_token missing from trakt.json; re-authentication required.")
         return None
 
-    response = requests.post(
+    response = _SESSION.post(
         'https://api.trakt.tv/oauth/token',
         json={
             'refresh_token': refresh_token,
@@ -61,9 +125,6 @@ def _refresh_token(token_data):
             'client_secret': CLIENT_SECRET,
             'grant_type': 'refresh_token'
         },
-        headers={
-            'Content-Type': 'application/json'
-        },
         timeout=30
     )
 
@@ -77,12 +138,21 @@ def _refresh_token(token_data):
         print(f"Error: unable to parse refresh response: {e}")
         return None
 
-    # Persist refreshed token
+    # Persist refreshed token: write a temp file next to it and swap it in,
+    # so a crash or a concurrent reader never sees a partial token file
+    tmp_path = TOKEN_FILE + '.tmp'
     try:
-        with open(TOKEN_FILE, 'w') as f:
-            json.dump(refreshed, f, indent=2)
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(refreshed, separators=(',', ':')))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, TOKEN_FILE)
     except Exception as e:
         print(f"Error: failed to write refreshed token: {e}")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
         return None
 
     return refreshed
@@ -99,23 +169,23 @@ def authenticate():
     
     Trakt.configuration.defaults.client(id=CLIENT_ID, secret=CLIENT_SECRET)
     
-    if not os.path.exists(TOKEN_FILE):
-        print(f"Error: Token file {TOKEN_FILE} not found. Run authenticate.py first.")
-        return False
-    
     try:
-        with open(TOKEN_FILE, 'r') as f:
-            token_data = json.load(f)
+        entry = _load_token_entry()
+        if entry is None:
+            print(f"Error: Token file {TOKEN_FILE} not found. Run authenticate.py first.")
+            return False
         
+        token_data, expires_at = entry
         if not token_data:
             print(f"Error: Token file {TOKEN_FILE} is empty")
             return False
 
-        if _token_expired(token_data):
+        if _token_expired(expires_at):
             print("Token expired; attempting refresh...")
             refreshed = _refresh_token(token_data)
             if not refreshed:
                 return False
+            _load_token.cache_clear()
             token_data = refreshed
             
         Trakt.configuration.defaults.oauth.from_response(token_data)
@@ -135,18 +205,20 @@ if __name__ == "__main__":
         print("Authentication successful!")
         
         # Debug: Show what fields are available in history response
-        print("\nFetching sample item to show available fields...")
-        try:
-            history = Trakt['sync/history'].get(pagination=True, per_page=1, extended='full')
-            if history:
-                item = list(history)[0]
-                print(f"\nSample item type: {type(item).__name__}")
-                print(f"Available attributes: {dir(item)}")
-                item_dict = item.to_dict()
-                print(f"\nDictionary keys: {list(item_dict.keys())}")
-                print(f"\nSample data:")
-                print(json.dumps(item_dict, indent=2, default=str))
-        except Exception as e:
-            print(f"Error fetching sample: {e}")
+        # (set TRAKT_DEBUG=1; this makes extra API calls)
+        if os.getenv('TRAKT_DEBUG'):
+            print("\nFetching sample item to show available fields...")
+            try:
+                history = Trakt['sync/history'].get(pagination=True, per_page=1, extended='full')
+                item = next(iter(history), None) if history else None
+                if item is not None:
+                    print(f"\nSample item type: {type(item).__name__}")
+                    print(f"Available attributes: {dir(item)}")
+                    item_dict = item.to_dict()
+                    print(f"\nDictionary keys: {list(item_dict.keys())}")
+                    print(f"\nSample data:")
+                    print(json.dumps(item_dict, indent=2, default=str))
+            except Exception as e:
+                print(f"Error fetching sample: {e}")
     else:
         print("Authentication failed!")
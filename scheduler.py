@@ -6,8 +6,8 @@ Runs update_trakt_local.py every hour for all users.
 
 import os
 import sys
-import subprocess
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
@@ -39,53 +39,38 @@ ALL_USERS = [PRIMARY_USER] + ADDITIONAL_USERS
 
 TRAKT_DIR = os.path.dirname(os.path.abspath(__file__))
 UPDATE_SCRIPT = os.path.join(TRAKT_DIR, 'scripts', 'update_trakt_local.py')
+UPDATE_TIMEOUT = 600  # seconds
 
 logger.info(f"Scheduler initialized: PRIMARY_USER={PRIMARY_USER}, ALL_USERS={ALL_USERS}")
 logger.info(f"UPDATE_SCRIPT={UPDATE_SCRIPT}, exists={os.path.exists(UPDATE_SCRIPT)}")
 
 scheduler = None
 
+# Loaded once per process and shared with the web app's /refresh
+from trakt_updater import UPDATER as updater
+
 
 def run_update_for_user(username):
-    """Execute update_trakt_local.py for a specific user."""
+    """Run the update_trakt_local.py updater for a specific user."""
     try:
         logger.info(f"Starting update for user: {username}")
         
-        # Verify the update script exists
-        if not os.path.exists(UPDATE_SCRIPT):
-            logger.error(f"✗ Update script not found: {UPDATE_SCRIPT}")
+        if updater is None:
+            logger.error(f"✗ Update script not loaded: {UPDATE_SCRIPT}")
             return
         
-        cmd = [
-            sys.executable,
-            UPDATE_SCRIPT,
-            '--user', username
-        ]
         # Use incremental mode for faster updates
         # Ratings are always fetched fresh on every run (ratings API is fast)
         # No need for --force flag which would do a full refresh and timeout
-        
-        logger.debug(f"Running command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-        
-        if result.returncode == 0:
-            logger.info(f"✓ Update completed for {username}")
-            # Log output for debugging
-            if result.stdout:
-                # Log last 10 lines
-                lines = result.stdout.strip().split('\n')
-                for line in lines[-10:]:
-                    if line.strip():
-                        logger.debug(f"  {line}")
-        else:
-            logger.error(f"✗ Update failed for {username}")
-            logger.error(f"Return code: {result.returncode}")
-            if result.stderr:
-                logger.error(f"STDERR: {result.stderr}")
-            if result.stdout:
-                logger.error(f"STDOUT (last 20 lines):\n" + '\n'.join(result.stdout.split('\n')[-20:]))
-    except subprocess.TimeoutExpired:
-        logger.error(f"✗ Update timed out for {username} (timeout: 600s)")
+        # An update that timed out in an earlier cycle may still be running
+        # (threads cannot be killed): skip the user instead of queueing behind it
+        if not updater.run_update_for_user(username, wait=False):
+            logger.warning(f"Skipping {username}: a previous update is still running")
+            return
+        logger.info(f"✓ Update completed for {username}")
+    except SystemExit as e:
+        # The updater reports fatal errors through SystemExit
+        logger.error(f"✗ Update failed for {username}: {e}")
     except Exception as e:
         logger.exception(f"✗ Error updating {username}: {e}")
 
@@ -93,8 +78,25 @@ def run_update_for_user(username):
 def update_all_users():
     """Update watch history for all configured users."""
     logger.info(f"Starting scheduled update for all users: {ALL_USERS}")
-    for username in ALL_USERS:
-        run_update_for_user(username)
+    # All users share one OAuth token. Update the first user on its own so an
+    # expired token is refreshed once, then run the rest concurrently; each
+    # update mostly waits on the Trakt API.
+    first_user, other_users = ALL_USERS[0], ALL_USERS[1:]
+    executor = ThreadPoolExecutor(max_workers=max(1, min(len(other_users), 4)), thread_name_prefix='update')
+    try:
+        futures = {executor.submit(run_update_for_user, first_user): first_user}
+        wait(futures, timeout=UPDATE_TIMEOUT)
+        if other_users and all(f.done() for f in futures):
+            futures = {executor.submit(run_update_for_user, username): username for username in other_users}
+            wait(futures, timeout=UPDATE_TIMEOUT)
+        elif other_users:
+            logger.warning(f"Skipping {other_users} this cycle; update for {first_user} is still running")
+        # A running update thread cannot be killed; report it and let it finish
+        for future, username in futures.items():
+            if not future.done():
+                logger.error(f"✗ Update timed out for {username} (timeout: {UPDATE_TIMEOUT}s)")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     logger.info("Scheduled update cycle completed")
 
 
@@ -115,13 +117,18 @@ def start_scheduler():
         return None
     
     try:
-        # Schedule update every hour
+        # Schedule update every hour. Runs missed while the process was
+        # suspended collapse into one, never overlap, and are spread by a
+        # few minutes so instances don't all hit Trakt on the hour.
         scheduler.add_job(
             update_all_users,
-            trigger=IntervalTrigger(hours=1),
+            trigger=IntervalTrigger(hours=1, jitter=300),
             id='update_all_users',
             name='Update Trakt history for all users',
-            replace_existing=True
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+            misfire_grace_time=600
         )
         logger.info("✓ Job added to scheduler")
     except Exception as e:
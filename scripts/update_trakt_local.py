@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
 import os
+import re
+import sys
 import json
+import gzip
+import hashlib
+import tempfile
 import importlib.util
 import time
+import queue
+import threading
 from datetime import datetime, timedelta
 import urllib.parse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import argparse
+from functools import lru_cache
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; fall back to the stdlib parser/encoder
+    orjson = None
 try:
     from dotenv import load_dotenv
 except Exception:
@@ -41,6 +58,63 @@ if not PRIMARY_USER:
 
 print(f"update_trakt_local.py: using TRAKT_DIR={TRAKT_DIR}, PRIMARY_USER={PRIMARY_USER}")
 
+class RateLimiter:
+    """Thread-safe token bucket: up to `rate` calls per `per` seconds, bursting to `rate`."""
+
+    def __init__(self, rate, per):
+        self.capacity = float(rate)
+        self.fill_rate = rate / per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.fill_rate if self.tokens < 0 else 0
+        # Callers reserve their token under the lock and wait outside it
+        if wait:
+            time.sleep(wait)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """HTTPAdapter that takes a token from `limiter` before each request."""
+
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.limiter.acquire()
+        return super().send(request, **kwargs)
+
+
+# Trakt allows 1000 GET calls per 5 minutes per app/user; stay a little under
+# it so concurrent lookups are paced instead of running into 429 cooldowns
+TRAKT_RATE_LIMIT = RateLimiter(900, 300)
+
+# Shared session for every Trakt API call: keeps pooled connections alive
+# across requests and threads, paces them under the rate limit, and retries
+# rate-limited (429, honouring Retry-After) and 5xx responses
+SESSION = requests.Session()
+SESSION.mount('https://api.trakt.tv/', RateLimitedAdapter(
+    TRAKT_RATE_LIMIT,
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    ),
+))
+LOOKUP_WORKERS = 8
+
 def get_user_paths(username: str = None):
     """Get raw and output paths for a user. If username is None, uses primary user."""
     if username is None:
@@ -57,7 +131,360 @@ def get_user_paths(username: str = None):
     
     return raw_path, out_path
 
-def main():
+def load_json(path):
+    """Parse a JSON file, using orjson when it is installed."""
+    if orjson is None:
+        with open(path, 'r') as f:
+            return json.load(f)
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+def dump_json(obj, indent=False):
+    """Serialize obj to UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson is None:
+        if indent:
+            return json.dumps(obj, indent=2).encode('utf-8')
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+
+def response_json(response):
+    """Decode a requests response body as JSON, using orjson when it is installed."""
+    if orjson is None:
+        return response.json()
+    return orjson.loads(response.content)
+
+def content_hash(data):
+    """Short BLAKE2b digest of serialized data, used to detect unchanged files."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# Cross-run cache of Trakt lookups that rarely change: section -> key -> [stored_at, value].
+# Entries older than their section's TTL (seconds) are dropped on load.
+LOOKUP_CACHE_TTL = {
+    'show_ids': 7 * 24 * 3600,  # show title -> ids of the best search match (None when nothing matched)
+    'people': 30 * 24 * 3600,  # 'movies/<id>' or 'shows/<id>' -> top cast names
+    'seasons': 7 * 24 * 3600,  # show trakt id -> seasons with episode ids, titles, first_aired
+    'shows': 7 * 24 * 3600,    # show trakt id -> {'genres', 'year'} from the show details
+}
+# Misses (stored as None) are kept for a shorter time, so a title that did
+# not match once is searched again soon
+LOOKUP_CACHE_MISS_TTL = 24 * 3600
+
+def load_lookup_cache(path):
+    """Load the lookup cache at path without expired entries; {} if missing or unreadable."""
+    try:
+        cache = load_json(path)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    now = time.time()
+    fresh = {}
+    for section, ttl in LOOKUP_CACHE_TTL.items():
+        entries = cache.get(section)
+        if isinstance(entries, dict):
+            fresh[section] = {
+                key: entry for key, entry in entries.items()
+                if isinstance(entry, list) and len(entry) == 2
+                and now - entry[0] < (ttl if entry[1] is not None else min(ttl, LOOKUP_CACHE_MISS_TTL))
+            }
+    return fresh
+
+def write_atomic(path, data):
+    """Write bytes to path via a temporary file and os.replace, so readers never see a partial file.
+
+    The file gets the 0644 mode of a regular data file (mkstemp creates 0600),
+    so a web server running as another user can still read it.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+# trakt_lookup_cache.json is shared by every user, and the scheduler updates
+# users concurrently in one process: saves are serialized and merged
+_LOOKUP_CACHE_LOCK = threading.Lock()
+
+def save_lookup_cache(path, cache):
+    """Merge this run's lookup cache into the file at path and write it atomically.
+
+    The file is re-read under a lock, so entries stored meanwhile by another
+    user's run are kept; for keys both have, the newer entry wins.
+    """
+    with _LOOKUP_CACHE_LOCK:
+        merged = load_lookup_cache(path)
+        for section, entries in cache.items():
+            stored = merged.setdefault(section, {})
+            for key, entry in entries.items():
+                current = stored.get(key)
+                if current is None or current[0] <= entry[0]:
+                    stored[key] = entry
+        write_atomic(path, dump_json(merged))
+
+def write_with_gzip(path, chunks, compresslevel=6):
+    """Write byte chunks to path and a gzip copy to path + '.gz' in one pass.
+
+    Compression runs on a second thread fed through a bounded queue, so zlib
+    (which releases the GIL) overlaps with producing and writing the chunks.
+    Both are written to uniquely named temporary siblings (so concurrent
+    writers cannot clobber each other's) and only moved into place with
+    os.replace once complete, so readers never see a partial file. The
+    temporary files get the web-readable mode of a regular output file.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=name + '.')
+    try:
+        gz_fd, gz_tmp_path = tempfile.mkstemp(dir=directory, prefix=name + '.gz.')
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    pending = queue.Queue(maxsize=256)
+    errors = []
+
+    def compress():
+        chunk = b''
+        try:
+            with os.fdopen(gz_fd, 'wb') as raw, \
+                    gzip.GzipFile(path + '.gz', 'wb', compresslevel, fileobj=raw) as gz:
+                while (chunk := pending.get()) is not None:
+                    gz.write(chunk)
+        except BaseException as e:
+            errors.append(e)
+            # keep consuming so the producer never blocks on a full queue
+            while chunk is not None:
+                chunk = pending.get()
+
+    try:
+        compressor = threading.Thread(target=compress, name='gzip-writer', daemon=True)
+        compressor.start()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    pending.put(chunk)
+        finally:
+            pending.put(None)
+            compressor.join()
+        if errors:
+            raise errors[0]
+        for done_path in (tmp_path, gz_tmp_path):
+            os.chmod(done_path, 0o644)
+        os.replace(tmp_path, path)
+        os.replace(gz_tmp_path, path + '.gz')
+    except BaseException:
+        for leftover in (tmp_path, gz_tmp_path):
+            try:
+                os.unlink(leftover)
+            except OSError:
+                pass
+        raise
+
+def iter_history_json(header, items, indent=False):
+    """Yield the processed output as UTF-8 JSON chunks, one per item.
+
+    Compact by default; with indent it is laid out like
+    json.dumps({**header, 'items': items}, indent=2). Either way the document
+    is never built in memory as a whole. Items are encoded with dump_json(),
+    so orjson (when installed) leaves non-ASCII text unescaped.
+    """
+    if not indent:
+        # '{...,"items":[]}' minus the closing ']}'
+        yield json.dumps({**header, 'items': []}, separators=(',', ':'))[:-2].encode('utf-8')
+        empty = True
+        for item in items:
+            yield dump_json(item) if empty else b',' + dump_json(item)
+            empty = False
+        yield b']}'
+        return
+    yield b'{\n'
+    for key, value in header.items():
+        yield f'  {json.dumps(key)}: {json.dumps(value)},\n'.encode('utf-8')
+    yield b'  "items": ['
+    empty = True
+    for item in items:
+        yield (b'\n    ' if empty else b',\n    ') + dump_json(item, indent=True).replace(b'\n', b'\n    ')
+        empty = False
+    yield b']\n}' if empty else b'\n  ]\n}'
+
+def fetch_all_pages(url, headers, params, check_response, timeout=60, max_workers=4):
+    """Fetch every page of a paginated Trakt list endpoint.
+
+    The first page is fetched on its own to read X-Pagination-Page-Count; the
+    remaining pages are then requested concurrently and returned in page order.
+    check_response(response) should raise on an error response.
+    """
+    def fetch_page(page):
+        response = SESSION.get(url, headers=headers, params={**params, 'page': page}, timeout=timeout)
+        check_response(response)
+        return response_json(response) or []
+
+    response = SESSION.get(url, headers=headers, params={**params, 'page': 1}, timeout=timeout)
+    check_response(response)
+    all_items = response_json(response) or []
+    if not all_items:
+        return all_items
+    total_pages = int(response.headers.get('X-Pagination-Page-Count', 1))
+    if total_pages <= 1:
+        return all_items
+
+    print(f"  Fetched page 1 of {total_pages}, fetching the rest...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for page, items in enumerate(executor.map(fetch_page, range(2, total_pages + 1)), start=2):
+            all_items.extend(items)
+            print(f"  Fetched page {page}, {len(all_items)} items so far...")
+    return all_items
+
+@lru_cache(maxsize=2048)
+def search_url(title):
+    """Trakt /search/show URL for title (titles repeat across a show's episodes)."""
+    return f"https://api.trakt.tv/search/show?query={urllib.parse.quote_plus(title)}"
+
+def search_shows(title, headers=None, timeout=10):
+    """Return every Trakt /search/show result for title, best match first.
+
+    Raises on network and HTTP errors so callers can tell a failed lookup
+    from a search with no results.
+    """
+    r = SESSION.get(search_url(title), headers=headers, timeout=timeout)
+    r.raise_for_status()
+    return response_json(r) or []
+
+def search_show(title, headers=None, timeout=10):
+    """Return the best (first) Trakt /search/show match for title, or {}."""
+    results = search_shows(title, headers, timeout)
+    if not results:
+        return {}
+    return results[0].get('show', {})
+
+# Id types tried, in order, when building RPDB poster URLs
+SHOW_POSTER_ID_KEYS = ('tvdb', 'imdb', 'tmdb')
+MOVIE_POSTER_ID_KEYS = ('imdb', 'tmdb', 'tvdb')
+
+def rpdb_poster_url(api_key, ids, id_keys, tmdb_kind):
+    """RPDB poster URL for the first of id_keys present in ids, or None.
+
+    tmdb ids are namespaced by kind ('series' or 'movie') in RPDB paths.
+    """
+    for key in id_keys:
+        value = ids.get(key)
+        if value:
+            if key == 'tmdb':
+                value = f'{tmdb_kind}-{value}'
+            return f'https://api.ratingposterdb.com/{api_key}/{key}/poster-default/{value}.jpg?fallback=true'
+    return None
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]')
+
+def norm_title(title):
+    """Lowercase a title and drop everything but letters and digits, for loose matching."""
+    return _NON_ALNUM.sub('', (title or '').lower())
+
+SEARCH_CANDIDATES = 2
+
+@lru_cache(maxsize=None)
+def load_trakt_main():
+    """Import main.py (auth, token and API helpers) once per process."""
+    if not os.path.exists(MAIN_PY):
+        raise SystemExit('trakt/main.py not found')
+    # main.py imports its sibling trakt_auth.py
+    if TRAKT_DIR not in sys.path:
+        sys.path.insert(0, TRAKT_DIR)
+
+    spec = importlib.util.spec_from_file_location('trakt_main_local', MAIN_PY)
+    trakt_main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(trakt_main)
+
+    if not hasattr(trakt_main, 'authenticate'):
+        raise SystemExit('trakt/main.py missing authenticate()')
+    return trakt_main
+
+@lru_cache(maxsize=None)
+def local_watched_dt(value):
+    """Parse a watched_at value (ISO string or datetime) and convert it to local time.
+
+    The dedupe pass and normalize() both need this for every item, so each
+    distinct value is converted once; main() clears the cache per run.
+    """
+    if isinstance(value, str):
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        dt = datetime.fromisoformat(value)
+    elif isinstance(value, datetime):
+        dt = value
+    else:
+        return None
+    try:
+        return dt.astimezone()
+    except Exception:
+        return dt
+
+def format_watched(s):
+    """Format a watched timestamp as `YYYY-MM-DD HH:MM` in local time when possible."""
+    if not s:
+        return None
+    if isinstance(s, (str, datetime)):
+        try:
+            return local_watched_dt(s).strftime('%Y-%m-%d %H:%M')
+        except ValueError:
+            return s
+    return str(s)
+
+def normalize(item):
+    """Reduce a history item to the fields written to the processed output."""
+    watched = format_watched(item.get('watched_at_iso') or item.get('watched_at_str') or item.get('watched_at'))
+    is_movie = (item.get('force_type') == 'movie' or item.get('class_name') == 'Movie'
+                or bool(item.get('movie')))
+    if is_movie:
+        m = item.get('movie') or item
+        out = {
+            'watched_at': watched,
+            'type': 'movie',
+            'title': m.get('title') or item.get('title'),
+            'year': m.get('year') or item.get('year'),
+            'ids': m.get('ids') or item.get('ids'),
+            'runtime': m.get('runtime') or item.get('runtime'),
+            'rating': item.get('user_rating'),  # Use only user rating
+            'genres': m.get('genres') or item.get('genres'),
+            'cast': item.get('cast', []),
+        }
+    else:
+        ep = item.get('episode') or item
+        show = item.get('show') or {}
+        season = item.get('extracted_season')
+        if season is None:
+            season = (ep.get('season') if isinstance(ep, dict) else None) or item.get('season')
+        number = ep.get('number') if isinstance(ep, dict) else None
+        if number is None:
+            number = item.get('number')
+        out = {
+            'watched_at': watched,
+            'type': 'episode',
+            'title': ep.get('title') or item.get('title'),
+            'season': season if season is not None else 1,
+            'number': number,
+            'ids': ep.get('ids') or item.get('ids'),
+            'runtime': ep.get('runtime') or item.get('runtime'),
+            'rating': item.get('user_rating'),  # Use only user rating
+            'show': {'title': show.get('title') or item.get('extracted_show_title')},
+            'genres': show.get('genres') or item.get('genres'),
+            'year': show.get('year') or item.get('year'),
+            'cast': item.get('cast', []),
+        }
+    # include thumbnail if available
+    thumbnail = item.get('thumbnail')
+    if thumbnail:
+        out['thumbnail'] = thumbnail
+    return out
+
+def main(argv=None):
     start_time = datetime.now()
     
     # CLI flags for quicker debug runs
@@ -69,7 +496,11 @@ def main():
     parser.add_argument('--no-enrichment', action='store_true', help='Do not enrich episodes with show genres/year (much faster)')
     parser.add_argument('--verbose', action='store_true', help='Verbose logging')
     parser.add_argument('--force', action='store_true', help='Force reprocessing even if raw data unchanged')
-    args = parser.parse_args()
+    parser.add_argument('--pretty-raw', action='store_true', help='Indent the raw cache file for manual inspection')
+    parser.add_argument('--pretty', action='store_true', help='Indent the processed output file for manual inspection')
+    parser.add_argument('--refresh-thumbnails', action='store_true', help='Ignore cached show ID lookups (used for thumbnails and enrichment)')
+    parser.add_argument('--refresh-lookups', action='store_true', help='Ignore cached show seasons, searches, details and cast lists')
+    args = parser.parse_args(argv)
     
     username = args.user
     RAW_PATH, OUT_PATH = get_user_paths(username)
@@ -77,23 +508,8 @@ def main():
     print(f"  Raw cache: {RAW_PATH}")
     print(f"  Output: {OUT_PATH}")
 
-    if not os.path.exists(MAIN_PY):
-        raise SystemExit('trakt/main.py not found')
-
-    spec = importlib.util.spec_from_file_location('trakt_main_local', MAIN_PY)
-    trakt_main = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(trakt_main)
-
-    if not hasattr(trakt_main, 'authenticate'):
-        raise SystemExit('trakt/main.py missing authenticate()')
-
-    # authenticate() in main.py expects token file in its working directory; switch cwd temporarily
-    prev_cwd = os.getcwd()
-    try:
-        os.chdir(TRAKT_DIR)
-        authed = trakt_main.authenticate()
-    finally:
-        os.chdir(prev_cwd)
+    trakt_main = load_trakt_main()
+    authed = trakt_main.authenticate()
 
     if not authed:
         raise SystemExit(f'Authentication failed; ensure trakt.json exists in {TRAKT_DIR}')
@@ -101,33 +517,27 @@ def main():
     # Check for existing cache to enable incremental updates
     start_at = None
     cached_items = []
-    if os.path.exists(RAW_PATH) and not args.force:
+    if not args.force:
         try:
-            with open(RAW_PATH, 'r') as f:
-                cached_items = json.load(f)
+            cached_items = load_json(RAW_PATH)
             
-            # Find the most recent watched_at timestamp
-            if cached_items:
-                timestamps = []
-                for item in cached_items:
-                    watched = item.get('watched_at_iso') or item.get('watched_at')
-                    if watched:
-                        try:
-                            if isinstance(watched, str):
-                                # Parse ISO format
-                                ts = datetime.fromisoformat(watched.replace('Z', '+00:00'))
-                            else:
-                                ts = watched
-                            timestamps.append(ts)
-                        except Exception:
-                            pass
-                
-                if timestamps:
-                    latest = max(timestamps)
+            # Find the most recent watched_at timestamp. Trakt returns them as
+            # UTC ISO strings, which sort chronologically, so only the latest
+            # one needs parsing.
+            watched_values = (item.get('watched_at_iso') or item.get('watched_at') for item in cached_items)
+            latest_watched = max((w for w in watched_values if isinstance(w, str)), default=None)
+            if latest_watched:
+                try:
+                    latest = datetime.fromisoformat(latest_watched.replace('Z', '+00:00'))
+                except ValueError:
+                    latest = None
+                if latest:
                     # Add 1 second to avoid re-fetching the last item (Trakt's start_at is inclusive)
                     start_at = latest + timedelta(seconds=1)
                     print(f"Found {len(cached_items)} cached items, latest watched: {latest.isoformat()}")
                     print("Fetching only new items since last update (incremental mode)...")
+        except FileNotFoundError:
+            pass
         except Exception as e:
             print(f"Could not read cache for incremental update: {e}")
             cached_items = []
@@ -141,10 +551,9 @@ def main():
     try:
         # Use extended='full' to get all metadata including images
         # Note: Trakt API does not include cast in sync/history endpoint
-        # Set a reasonable timeout
-        import socket
-        old_timeout = socket.getdefaulttimeout()
-        socket.setdefaulttimeout(60)  # 60 second timeout for slower connections
+        # fetch_all_pages() gives each page request a 60 second timeout for
+        # slower connections (no process-wide socket default: this also runs
+        # inside the web app and scheduler)
         
         print(f"Calling Trakt API for user: {username}...")
         # Fetch watch history
@@ -154,61 +563,23 @@ def main():
             # Use authenticated sync endpoint for primary user
             # Use direct HTTP API calls instead of trakt.py library to avoid None returns
             
-            # Get access token from the token file
-            token_file_path = os.path.join(TRAKT_DIR, 'trakt.json')
-            access_token = None
-            if os.path.exists(token_file_path):
-                with open(token_file_path, 'r') as f:
-                    token_data = json.load(f)
-                    access_token = token_data.get('access_token')
+            headers = trakt_main.api_headers()
             
-            headers = {
-                'Content-Type': 'application/json',
-                'trakt-api-version': '2',
-                'trakt-api-key': trakt_main.CLIENT_ID,
+            params = {
+                'limit': 100,
+                'extended': 'full'
             }
-            if access_token:
-                headers['Authorization'] = f'Bearer {access_token}'
-            
-            all_items = []
-            page = 1
-            
-            while True:
-                url = 'https://api.trakt.tv/sync/history'
-                params = {
-                    'page': page,
-                    'limit': 100,
-                    'extended': 'full'
-                }
-                
-                if start_at and page == 1:
-                    # For incremental updates
-                    params['start_at'] = start_at.isoformat()
-                
-                response = requests.get(url, headers=headers, params=params, timeout=60)
-                
+            if start_at:
+                # For incremental updates
+                params['start_at'] = start_at.isoformat()
+
+            def check_history(response):
                 if response.status_code == 401:
                     raise SystemExit(f'Authentication failed for primary user - check token in trakt.json')
                 elif response.status_code != 200:
                     raise SystemExit(f'API error {response.status_code}: {response.text}')
-                
-                items = response.json()
-                if not items:
-                    break
-                
-                all_items.extend(items)
-                
-                # Check pagination headers
-                if 'X-Pagination-Page-Count' in response.headers:
-                    total_pages = int(response.headers['X-Pagination-Page-Count'])
-                    if page >= total_pages:
-                        break
-                else:
-                    # No more pages
-                    break
-                
-                page += 1
-                print(f"  Fetched page {page-1}, {len(all_items)} items so far...")
+
+            all_items = fetch_all_pages('https://api.trakt.tv/sync/history', headers, params, check_history)
             
             history_objs = all_items
         else:
@@ -216,70 +587,30 @@ def main():
             # trakt.py doesn't support dynamic user IDs, so we'll use direct HTTP
             # (requests is already imported at module level)
             
-            # Get access token from the token file
-            token_file_path = os.path.join(TRAKT_DIR, 'trakt.json')
-            access_token = None
-            if os.path.exists(token_file_path):
-                with open(token_file_path, 'r') as f:
-                    token_data = json.load(f)
-                    access_token = token_data.get('access_token')
+            headers = trakt_main.api_headers()
             
-            headers = {
-                'Content-Type': 'application/json',
-                'trakt-api-version': '2',
-                'trakt-api-key': trakt_main.CLIENT_ID,
+            params = {
+                'limit': 100,
+                'extended': 'full'
             }
-            if access_token:
-                headers['Authorization'] = f'Bearer {access_token}'
-            
-            all_items = []
-            page = 1
-            
-            while True:
-                url = f'https://api.trakt.tv/users/{username}/history'
-                params = {
-                    'page': page,
-                    'limit': 100,
-                    'extended': 'full'
-                }
-                
-                if start_at and page == 1:
-                    # For incremental updates
-                    params['start_at'] = start_at.isoformat()
-                
-                response = requests.get(url, headers=headers, params=params, timeout=60)
-                
+            if start_at:
+                # For incremental updates
+                params['start_at'] = start_at.isoformat()
+
+            def check_history(response):
                 if response.status_code == 404:
                     raise SystemExit(f'User {username} not found or watch history is private')
                 elif response.status_code != 200:
                     raise SystemExit(f'API error {response.status_code}: {response.text}')
-                
-                items = response.json()
-                if not items:
-                    break
-                
-                all_items.extend(items)
-                
-                # Check pagination headers
-                if 'X-Pagination-Page-Count' in response.headers:
-                    total_pages = int(response.headers['X-Pagination-Page-Count'])
-                    if page >= total_pages:
-                        break
-                else:
-                    # No more pages
-                    break
-                
-                page += 1
-                print(f"  Fetched page {page-1}, {len(all_items)} items so far...")
+
+            all_items = fetch_all_pages(f'https://api.trakt.tv/users/{username}/history', headers, params, check_history)
             
             # Convert raw JSON to trakt.py objects (or just use raw data)
             # For simplicity, we'll work with raw JSON since we process it anyway
             history_objs = all_items
             
         print("API call successful, processing results...")
-        
-        socket.setdefaulttimeout(old_timeout)  # Restore original timeout
-    except socket.timeout as e:
+    except requests.exceptions.Timeout as e:
         print(f"Timeout error fetching history from Trakt API: {e}")
         import traceback
         traceback.print_exc()
@@ -301,49 +632,16 @@ def main():
         # Always fetch ratings via HTTP API for reliability
         try:
             print("  Fetching ratings via direct Trakt API...")
-            token_file_path = os.path.join(TRAKT_DIR, 'trakt.json')
-            access_token = None
-            if os.path.exists(token_file_path):
-                with open(token_file_path, 'r') as f:
-                    token_data = json.load(f)
-                    access_token = token_data.get('access_token')
-
-            headers = {
-                'Content-Type': 'application/json',
-                'trakt-api-version': '2',
-                'trakt-api-key': trakt_main.CLIENT_ID,
-            }
-            if access_token:
-                headers['Authorization'] = f'Bearer {access_token}'
-
-            all_ratings = []
-            page = 1
-            while True:
-                url = 'https://api.trakt.tv/sync/ratings'
-                params = {
-                    'page': page,
-                    'limit': 100,
-                    'extended': 'full'
-                }
-                response = requests.get(url, headers=headers, params=params, timeout=30)
+            headers = trakt_main.api_headers()
+
+            def check_ratings(response):
                 if response.status_code == 401:
                     raise SystemExit('Authentication failed for ratings - check token in trakt.json')
                 if response.status_code != 200:
                     raise SystemExit(f'Ratings API error {response.status_code}: {response.text}')
 
-                items = response.json()
-                if not items:
-                    break
-                all_ratings.extend(items)
-
-                if 'X-Pagination-Page-Count' in response.headers:
-                    total_pages = int(response.headers['X-Pagination-Page-Count'])
-                    if page >= total_pages:
-                        break
-                else:
-                    break
-
-                page += 1
+            all_ratings = fetch_all_pages('https://api.trakt.tv/sync/ratings', headers,
+                                          {'limit': 100, 'extended': 'full'}, check_ratings, timeout=30)
 
             for r in all_ratings:
                 item_type = r.get('type')
@@ -374,127 +672,28 @@ def main():
     else:
         print(f"  Skipping ratings for non-primary user {username}")
     
-    history = []
-    seen = 0
-    print(f"\nProcessing history items...")
-    for item in history_objs:
-        # Handle both trakt.py objects and raw JSON
-        if isinstance(item, dict):
-            # Raw JSON from public user history endpoint
-            d = item
-            # Determine type from the structure
-            if 'movie' in d:
-                d['force_type'] = 'movie'
-                # Normalize: extract movie IDs to top level for cast fetching
-                if 'movie' in d and isinstance(d['movie'], dict):
-                    if 'ids' not in d and 'ids' in d['movie']:
-                        d['ids'] = d['movie']['ids']
-            elif 'episode' in d:
-                d['force_type'] = 'episode'
-            else:
-                continue  # Skip unknown types
-            
-            # Extract watched_at timestamp
-            if 'watched_at' in d:
-                d['watched_at_iso'] = d['watched_at']
-            
-            # For non-primary users, we don't fetch ratings (would need their auth)
-            # They can set up their own instance if they want ratings
-            if username == PRIMARY_USER and user_ratings:
-                if d.get('force_type') == 'movie':
-                    m = d.get('movie') or {}
-                    trakt_id = (m.get('ids') or {}).get('trakt') or (d.get('ids') or {}).get('trakt')
-                    if trakt_id and ('movie', trakt_id) in user_ratings:
-                        d['user_rating'] = user_ratings[('movie', trakt_id)]
-                elif d.get('force_type') == 'episode':
-                    ep = d.get('episode') or {}
-                    trakt_id = (ep.get('ids') or {}).get('trakt') or (d.get('ids') or {}).get('trakt')
-                    if trakt_id and ('episode', trakt_id) in user_ratings:
-                        d['user_rating'] = user_ratings[('episode', trakt_id)]
-                    if 'user_rating' not in d:
-                        show = d.get('show') or {}
-                        show_trakt_id = (show.get('ids') or {}).get('trakt')
-                        if show_trakt_id and ('show', show_trakt_id) in user_ratings:
-                            d['user_rating'] = user_ratings[('show', show_trakt_id)]
-        else:
-            # trakt.py object from sync/history (primary user)
-            d = item.to_dict()
-            d['force_type'] = 'movie' if type(item).__name__ == 'Movie' else 'episode'
-            d['watched_at_iso'] = item.watched_at.isoformat() if getattr(item, 'watched_at', None) else None
-            
-            # Add user rating if available
-            trakt_id = None
-            if d['force_type'] == 'movie':
-                # For movies, the item itself IS the movie
-                if hasattr(item, 'get_key'):
-                    try:
-                        trakt_id = item.get_key('trakt')
-                    except:
-                        pass
-                if trakt_id and ('movie', trakt_id) in user_ratings:
-                    d['user_rating'] = user_ratings[('movie', trakt_id)]
-            elif d['force_type'] == 'episode':
-                # For episodes, try episode-level rating first
-                if hasattr(item, 'episode') and item.episode and hasattr(item.episode, 'get_key'):
-                    try:
-                        trakt_id = item.episode.get_key('trakt')
-                    except:
-                        pass
-                if trakt_id and ('episode', trakt_id) in user_ratings:
-                    d['user_rating'] = user_ratings[('episode', trakt_id)]
-                # Also check for show-level rating as fallback
-                if 'user_rating' not in d and hasattr(item, 'show') and item.show and hasattr(item.show, 'get_key'):
-                    try:
-                        show_trakt_id = item.show.get_key('trakt')
-                        if show_trakt_id and ('show', show_trakt_id) in user_ratings:
-                            d['user_rating'] = user_ratings[('show', show_trakt_id)]
-                    except:
-                        pass
-        
-        if d['force_type'] == 'episode':
-            d['extracted_show_title'] = item.show.title if hasattr(item, 'show') and item.show else None
-            if hasattr(item, 'episode') and item.episode:
-                d['extracted_season'] = item.episode.season
-        # include full show dict (with ids) when available to help season resolution
-        if hasattr(item, 'show') and item.show:
-            try:
-                d['show'] = item.show.to_dict()
-            except Exception:
-                d['show'] = {'title': item.show.title}
-        history.append(d)
-        seen += 1
-        if args.limit and seen >= args.limit:
-            if args.verbose:
-                print(f'--limit reached: {seen} items')
-            break
-    
-    print(f"Fetched {len(history)} new items from Trakt")
-    
-    # Merge with cached items for incremental updates
-    if cached_items:
-        print(f"Merging {len(history)} new items with {len(cached_items)} cached items...")
-        # Combine new and cached, keeping new items first
-        history = history + cached_items
-        print(f"Total items after merge: {len(history)}")
-
-    print("\n=== Deduplicating entries ===")
-    # Remove obvious duplicates: keep first occurrence of items with the same
-    # (force_type, trakt id or title fallback, watched_at_iso). This avoids
-    # showing the same movie twice when Trakt returned duplicates.
+    # Each run starts with an empty timestamp cache (see local_watched_dt)
+    local_watched_dt.cache_clear()
+
+    # Remove obvious duplicates while collecting items: keep the first
+    # occurrence of items with the same (force_type, trakt id or title
+    # fallback, episode, watched day). This avoids showing the same movie
+    # twice when Trakt returned duplicates.
     deduped = []
     seen_keys = set()
-    for it in history:
-        trakt_id = None
-        try:
-            trakt_id = (it.get('ids') or {}).get('trakt')
-        except Exception:
-            trakt_id = None
-        key_id = str(trakt_id) if trakt_id is not None else (it.get('title') or '')
+    duplicates = 0
+
+    def _dedupe_id(it):
+        trakt_id = (it.get('ids') or {}).get('trakt')
+        return trakt_id if trakt_id is not None else (it.get('title') or '')
+
+    def _dedupe_key(it):
+        key_id = _dedupe_id(it)
 
         # For episodes, include season and episode number to allow multiple episodes of same show on same day
         episode_identifier = None
         if it.get('force_type') == 'episode':
-            episode_data = it.get('episode', {})
+            episode_data = it.get('episode') or {}
             season = episode_data.get('season')
             number = episode_data.get('number')
             if season is not None and number is not None:
@@ -505,32 +704,98 @@ def main():
         watched_day = None
         if watched_raw:
             try:
-                wr = watched_raw
-                if isinstance(wr, str) and wr.endswith('Z'):
-                    wr = wr[:-1] + '+00:00'
-                dt = datetime.fromisoformat(wr) if isinstance(wr, str) else (wr if isinstance(wr, datetime) else None)
-                if isinstance(dt, datetime):
-                    try:
-                        local_dt = dt.astimezone()
-                    except Exception:
-                        local_dt = dt
+                local_dt = local_watched_dt(watched_raw)
+            except ValueError:
+                # fallback: extract YYYY-MM-DD prefix from string
+                watched_day = str(watched_raw)[:10]
+            else:
+                if local_dt is not None:
                     watched_day = local_dt.date().isoformat()
-            except Exception:
-                try:
-                    # fallback: extract YYYY-MM-DD prefix from string
-                    watched_day = str(watched_raw)[:10]
-                except Exception:
-                    watched_day = None
 
-        key = (it.get('force_type'), key_id, episode_identifier, watched_day)
+        return (it.get('force_type'), key_id, episode_identifier, watched_day)
+
+    def _add_unique(it):
+        nonlocal duplicates
+        key = _dedupe_key(it)
         if key in seen_keys:
+            duplicates += 1
             if args.verbose:
                 print(f'duplicate skipped: {key}')
-            continue
+            return
         seen_keys.add(key)
         deduped.append(it)
 
-    print(f"After deduplication: {len(deduped)} items (removed {len(history) - len(deduped)} duplicates)")
+    print(f"\nProcessing history items...")
+    if args.limit and len(history_objs) > args.limit:
+        if args.verbose:
+            print(f'--limit reached: {args.limit} items')
+        history_objs = islice(history_objs, args.limit)
+    for item in history_objs:
+        # Both history endpoints return raw JSON items
+        if not isinstance(item, dict):
+            continue
+        d = item
+        # Determine type from the structure
+        if 'movie' in d:
+            d['force_type'] = 'movie'
+            # Normalize: extract movie IDs to top level for cast fetching
+            if 'movie' in d and isinstance(d['movie'], dict):
+                if 'ids' not in d and 'ids' in d['movie']:
+                    d['ids'] = d['movie']['ids']
+        elif 'episode' in d:
+            d['force_type'] = 'episode'
+        else:
+            continue  # Skip unknown types
+        
+        # Extract watched_at timestamp
+        if 'watched_at' in d:
+            d['watched_at_iso'] = d['watched_at']
+        
+        # For non-primary users, we don't fetch ratings (would need their auth)
+        # They can set up their own instance if they want ratings
+        if username == PRIMARY_USER and user_ratings:
+            if d.get('force_type') == 'movie':
+                m = d.get('movie') or {}
+                trakt_id = (m.get('ids') or {}).get('trakt') or (d.get('ids') or {}).get('trakt')
+                if trakt_id and ('movie', trakt_id) in user_ratings:
+                    d['user_rating'] = user_ratings[('movie', trakt_id)]
+            elif d.get('force_type') == 'episode':
+                ep = d.get('episode') or {}
+                trakt_id = (ep.get('ids') or {}).get('trakt') or (d.get('ids') or {}).get('trakt')
+                if trakt_id and ('episode', trakt_id) in user_ratings:
+                    d['user_rating'] = user_ratings[('episode', trakt_id)]
+                if 'user_rating' not in d:
+                    show = d.get('show') or {}
+                    show_trakt_id = (show.get('ids') or {}).get('trakt')
+                    if show_trakt_id and ('show', show_trakt_id) in user_ratings:
+                        d['user_rating'] = user_ratings[('show', show_trakt_id)]
+        
+        _add_unique(d)
+    
+    fetched_count = len(deduped) + duplicates
+    # deduped[:fetched_unique] are the fetched items; cached items follow them
+    fetched_unique = len(deduped)
+    print(f"Fetched {fetched_count} new items from Trakt")
+    
+    # Merge with cached items for incremental updates, keeping new items first
+    if cached_items:
+        print(f"Merging {fetched_count} new items with {len(cached_items)} cached items...")
+        if start_at:
+            # The raw cache was deduplicated when it was written, so on an
+            # incremental run cached items only need checking against the new
+            # ones, and only those sharing a type and id/title with one can clash
+            new_ids = {key[:2] for key in seen_keys}
+            for it in cached_items:
+                if (it.get('force_type'), _dedupe_id(it)) in new_ids:
+                    _add_unique(it)
+                else:
+                    deduped.append(it)
+        else:
+            for it in cached_items:
+                _add_unique(it)
+        print(f"Total items after merge: {fetched_count + len(cached_items)}")
+
+    print(f"After deduplication: {len(deduped)} items (removed {duplicates} duplicates)")
 
     # Exit early if no new items - cache is already up to date
     if start_at and len(deduped) == len(cached_items):
@@ -586,49 +851,22 @@ def main():
 
     os.makedirs(os.path.dirname(RAW_PATH), exist_ok=True)
 
-    # Smart incremental processing: identify which items are new vs cached
-    new_items = []
-    cached_item_keys = set()
-    
+    # Smart incremental processing: identify which items are new vs cached.
+    # Cached items are only skipped when the previous processed output can be
+    # reused for them; without it everything is processed again.
+    cached_processed_items = None
     if cached_items and not args.force:
-        # Build a set of keys from cached items
-        for cached_item in cached_items:
-            trakt_id = None
-            try:
-                trakt_id = (cached_item.get('ids') or {}).get('trakt')
-            except Exception:
-                pass
-            key_id = str(trakt_id) if trakt_id is not None else (cached_item.get('title') or '')
-            watched_raw = cached_item.get('watched_at_iso') or cached_item.get('watched_at')
-            watched_day = None
-            if watched_raw:
-                try:
-                    watched_day = str(watched_raw)[:10]
-                except Exception:
-                    pass
-            key = (cached_item.get('force_type'), key_id, watched_day)
-            cached_item_keys.add(key)
-        
-        # Identify new items
-        for it in deduped:
-            trakt_id = None
-            try:
-                trakt_id = (it.get('ids') or {}).get('trakt')
-            except Exception:
-                pass
-            key_id = str(trakt_id) if trakt_id is not None else (it.get('title') or '')
-            watched_raw = it.get('watched_at_iso') or it.get('watched_at')
-            watched_day = None
-            if watched_raw:
-                try:
-                    watched_day = str(watched_raw)[:10]
-                except Exception:
-                    pass
-            key = (it.get('force_type'), key_id, watched_day)
-            
-            if key not in cached_item_keys:
-                new_items.append(it)
-        
+        try:
+            cached_processed_items = load_json(OUT_PATH).get('items', [])
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Could not load previous output, reprocessing all items: {e}")
+
+    if cached_processed_items is not None:
+        # Dedupe already decided which items are new: the fetched ones it
+        # kept. Cached items that survived it have processed copies in the
+        # previous output.
+        new_items = deduped[:fetched_unique]
+
         print(f"Identified {len(new_items)} new items to process (will reuse {len(cached_items)} from cache)")
     else:
         # No cache or force flag - process everything
@@ -639,83 +877,16 @@ def main():
     print("\n=== Processing new items (normalization and image fetching) ===")
     history = new_items
 
-    # normalize
-    def normalize(item):
-        out = {}
-        watched = item.get('watched_at_iso') or item.get('watched_at_str') or item.get('watched_at')
-
-        # Format watched timestamp to `YYYY-MM-DD HH:MM` in local timezone when possible
-        def format_watched(s):
-            if not s:
-                return None
-            if isinstance(s, datetime):
-                try:
-                    return s.astimezone().strftime('%Y-%m-%d %H:%M')
-                except Exception:
-                    return s.strftime('%Y-%m-%d %H:%M')
-            if isinstance(s, str):
-                try:
-                    ss = s
-                    # Normalize 'Z' to +00:00 for fromisoformat
-                    if ss.endswith('Z'):
-                        ss = ss[:-1] + '+00:00'
-                    dt = datetime.fromisoformat(ss)
-                    try:
-                        local_dt = dt.astimezone()
-                    except Exception:
-                        local_dt = dt
-                    return local_dt.strftime('%Y-%m-%d %H:%M')
-                except Exception:
-                    return s
-            return str(s)
-
-        out['watched_at'] = format_watched(watched)
-        is_movie = False
-        if item.get('force_type') == 'movie' or item.get('class_name') == 'Movie':
-            is_movie = True
-        if 'movie' in item and item.get('movie'):
-            is_movie = True
-        if is_movie:
-            m = item.get('movie') or item
-            out.update({
-                'type': 'movie',
-                'title': m.get('title') or item.get('title'),
-                'year': m.get('year') or item.get('year'),
-                'ids': m.get('ids') or item.get('ids'),
-                'runtime': m.get('runtime') or item.get('runtime'),
-                'rating': item.get('user_rating'),  # Use only user rating
-                'genres': m.get('genres') or item.get('genres'),
-                'cast': item.get('cast', []),
-            })
-            # include thumbnail if available
-            if item.get('thumbnail'):
-                out['thumbnail'] = item.get('thumbnail')
-        else:
-            ep = item.get('episode') or item
-            season = item.get('extracted_season') if item.get('extracted_season') is not None else (ep.get('season') if isinstance(ep, dict) else None) or item.get('season')
-            season = season if season is not None else 1
-            number = (ep.get('number') if isinstance(ep, dict) and ep.get('number') is not None else item.get('number'))
-            out.update({
-                'type': 'episode',
-                'title': ep.get('title') or item.get('title'),
-                'season': season,
-                'number': number,
-                'ids': ep.get('ids') or item.get('ids'),
-                'runtime': ep.get('runtime') or item.get('runtime'),
-                'rating': item.get('user_rating'),  # Use only user rating
-                'show': {'title': (item.get('show') or {}).get('title') or item.get('extracted_show_title')},
-                'genres': (item.get('show') or {}).get('genres') or item.get('genres'),
-                'year': (item.get('show') or {}).get('year') or item.get('year'),
-                'cast': item.get('cast', []),
-            })
-            # include thumbnail if available
-            if item.get('thumbnail'):
-                out['thumbnail'] = item.get('thumbnail')
-        return out
-
     # Load local .env to get TRAKT_CLIENT_ID for search fallback
     load_dotenv(os.path.join(TRAKT_DIR, '.env'))
     TRAKT_CLIENT_ID = os.getenv('TRAKT_CLIENT_ID')
+    if TRAKT_CLIENT_ID:
+        # Public (client id only) lookups below rely on these session-wide headers
+        SESSION.headers.update({
+            'Content-Type': 'application/json',
+            'trakt-api-version': '2',
+            'trakt-api-key': TRAKT_CLIENT_ID,
+        })
     RPDB_API_KEY = os.getenv('RPDB_API_KEY')
 
     print(f"\n=== Starting item processing (total: {len(history)} items) ===")
@@ -724,181 +895,328 @@ def main():
     else:
         print("Image fetching disabled")
     
+    # Show seasons, searches and cast lists are reused across runs (see LOOKUP_CACHE_TTL)
+    lookup_cache_path = os.path.join(os.path.dirname(RAW_PATH), 'trakt_lookup_cache.json')
+    lookup_cache = {} if args.refresh_lookups else load_lookup_cache(lookup_cache_path)
+    if args.refresh_thumbnails:
+        lookup_cache.pop('show_ids', None)
+    seasons_cache = lookup_cache.setdefault('seasons', {})
+    show_ids_by_title = lookup_cache.setdefault('show_ids', {})
+    lookup_cache_dirty = False
+
     # Attempt to resolve missing seasons by querying show seasons when possible
     show_cache = {}
     show_details = {}
     movie_details = {}
     show_cast = {}
     movie_cast = {}
+    # Per show: episode trakt id (str), normalized episode title and first_aired
+    # value -> season number, built once when the show's seasons are fetched
+    show_ep_index = {}
+    show_ep_titles = {}
+    show_ep_aired = {}
+    # Episode trakt id (str) -> season across every show indexed so far,
+    # including all shows stored in the lookup cache by recent runs
+    episode_seasons = {}
+
+    # Seasons are fetched with a plain GET on the shared session: trakt.py has
+    # no shows/{id}/seasons interface, so Trakt['shows/{id}/seasons'] never worked
+    seasons_headers = trakt_main.api_headers()
+
+    def _get_show_seasons(show_id):
+        try:
+            r = SESSION.get(f'https://api.trakt.tv/shows/{show_id}/seasons',
+                            headers=seasons_headers, params={'extended': 'episodes'}, timeout=30)
+            if r.status_code != 200:
+                return None
+            return response_json(r)
+        except Exception:
+            return None
+
+    def _fetch_show_seasons(show_id):
+        if show_id in show_cache:
+            return show_cache[show_id]
+        if _load_cached_seasons(show_id):
+            return show_cache[show_id]
+        return _store_show_seasons(show_id, _get_show_seasons(show_id))
+
+    def _load_cached_seasons(show_id):
+        """Index the seasons stored for show_id by a recent run, if any."""
+        entry = seasons_cache.get(str(show_id))
+        if not entry:
+            return False
+        _index_show_seasons(show_id, entry[1])
+        return True
+
+    def _store_show_seasons(show_id, seasons):
+        """Index freshly fetched seasons and keep the indexed fields for later runs."""
+        nonlocal lookup_cache_dirty
+        if seasons:
+            seasons_cache[str(show_id)] = [time.time(), [
+                {'number': season.get('number'), 'episodes': [
+                    {'ids': {'trakt': (ep.get('ids') or {}).get('trakt')},
+                     'title': ep.get('title'), 'first_aired': ep.get('first_aired')}
+                    for ep in season.get('episodes') or []
+                ]}
+                for season in seasons
+            ]]
+            lookup_cache_dirty = True
+        return _index_show_seasons(show_id, seasons)
+
+    def _index_show_seasons(show_id, seasons):
+        show_cache[show_id] = seasons
+        ep_index = {}
+        ep_titles = {}
+        ep_aired = {}
+        for s in seasons or []:
+            number = s.get('number')
+            for ep in (s.get('episodes') or []):
+                ep_id = ep.get('ids', {}).get('trakt')
+                # compare IDs as strings to avoid int/str mismatches
+                if ep_id is not None and ep_index.get(str(ep_id)) is None:
+                    ep_index[str(ep_id)] = number
+                    episode_seasons.setdefault(str(ep_id), number)
+                ep_title = norm_title(ep.get('title'))
+                if ep_title:
+                    ep_titles.setdefault(ep_title, number)
+                if ep.get('first_aired'):
+                    ep_aired.setdefault(ep.get('first_aired'), number)
+        show_ep_index[show_id] = ep_index
+        show_ep_titles[show_id] = ep_titles
+        show_ep_aired[show_id] = ep_aired
+        return seasons
     
-    processed_count = 0
+    # Split history by type once, pulling each episode's show title and ids
+    # out as we go; the passes below read these instead of re-checking
+    # force_type and re-walking it['show'] per item. show_key is the title
+    # used to look the show up by name (show title, else extracted_show_title).
+    movies = []
+    episodes = []
     for it in history:
-        processed_count += 1
+        if it.get('force_type') == 'movie':
+            movies.append(it)
+        elif it.get('force_type') == 'episode':
+            show = it.get('show')
+            if not isinstance(show, dict):
+                show = {}
+            show_title = show.get('title')
+            show_ids = show.get('ids')
+            episodes.append((
+                it,
+                show_title,
+                show_ids if isinstance(show_ids, dict) else None,
+                show_title or it.get('extracted_show_title'),
+            ))
+
+    # Fetch seasons once per distinct show whose episodes still need a season,
+    # concurrently, so the resolution loop below only does dict lookups.
+    # Seasons stored by a recent run are used when they already list every
+    # such episode; a show with newly aired episodes is fetched again.
+    def _episode_trakt_id(it):
+        # raw API items keep the episode's ids on the nested episode
+        return (it.get('ids') or (it.get('episode') or {}).get('ids') or {}).get('trakt')
+
+    def _needs_season(it):
+        """True when no season is known locally, so the network may be needed."""
+        if (it.get('extracted_season') is not None or it.get('season') is not None
+                or (it.get('episode') or {}).get('season') is not None):
+            return False
+        ep_trakt_id = _episode_trakt_id(it)
+        return not (ep_trakt_id and str(ep_trakt_id) in episode_seasons)
+
+    # Every episode a recent run saw in any show's seasons can be resolved
+    # without a request, whichever show it is matched to
+    if any(_needs_season(it) for it, _, _, _ in episodes):
+        for entry in seasons_cache.values():
+            for season in entry[1]:
+                for ep in season.get('episodes') or []:
+                    ep_id = (ep.get('ids') or {}).get('trakt')
+                    if ep_id is not None:
+                        episode_seasons.setdefault(str(ep_id), season.get('number'))
+
+    season_ep_ids = {}
+    for it, _, show_ids, _ in episodes:
+        if show_ids and show_ids.get('trakt') and _needs_season(it):
+            ep_ids = season_ep_ids.setdefault(show_ids.get('trakt'), set())
+            ep_trakt_id = _episode_trakt_id(it)
+            if ep_trakt_id:
+                ep_ids.add(str(ep_trakt_id))
+    season_show_ids = [
+        show_id for show_id, ep_ids in season_ep_ids.items()
+        if not (_load_cached_seasons(show_id) and ep_ids <= show_ep_index[show_id].keys())
+    ]
+    if season_show_ids:
+        with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+            for show_id, seasons in zip(season_show_ids, executor.map(_get_show_seasons, season_show_ids)):
+                _store_show_seasons(show_id, seasons)
+
+    def _search_candidates(title, results):
+        """Trakt ids of the search results worth fetching seasons for.
+
+        Fetching seasons is the expensive part: try shows whose title matches
+        exactly first (otherwise Trakt's order), and only the first couple.
+        """
+        target = norm_title(title)
+        results = sorted(
+            results,
+            key=lambda res: norm_title((res.get('show') or {}).get('title')) != target,
+        )[:SEARCH_CANDIDATES]
+        return [cand_id for res in results if (cand_id := (res.get('show') or {}).get('ids', {}).get('trakt'))]
+
+    def _search_title(title):
+        try:
+            return search_shows(title)
+        except Exception:
+            return None
+
+    def _searched_show_ids(title):
+        """Ids of the best match from this run's title search, or None if not searched."""
+        results = title_search_results.get(title)
+        if results is None:
+            return None
+        return (results[0].get('show') or {}).get('ids') or {} if results else {}
+
+    def _store_show_ids(title, show_ids):
+        nonlocal lookup_cache_dirty
+        show_ids_by_title[title] = [time.time(), show_ids or None]
+        lookup_cache_dirty = True
+
+    def _known_show_ids(title):
+        """Ids of title's best search match from the lookup cache or this run's
+        searches: {} if nothing matched, None if it has not been searched."""
+        entry = show_ids_by_title.get(title)
+        if entry is not None:
+            return entry[1] or {}
+        show_ids = _searched_show_ids(title)
+        if show_ids is not None:
+            _store_show_ids(title, show_ids)
+        return show_ids
+
+    # Episodes without show ids fall back to a title search: run those
+    # searches (once per title) and the candidates' season fetches
+    # concurrently too
+    title_search_results = {}
+    search_titles = {
+        it.get('extracted_show_title') or show_title for it, show_title, show_ids, _ in episodes
+        if not (show_ids and show_ids.get('trakt')) and _needs_season(it)
+        and (it.get('extracted_show_title') or show_title)
+    } if TRAKT_CLIENT_ID else set()
+    if search_titles:
+        with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+            title_search_results = dict(zip(search_titles, executor.map(_search_title, search_titles)))
+            candidate_ids = {
+                cand_id for title, results in title_search_results.items() if results
+                for cand_id in _search_candidates(title, results)
+            } - show_cache.keys()
+            candidate_ids = [show_id for show_id in candidate_ids if not _load_cached_seasons(show_id)]
+            for show_id, seasons in zip(candidate_ids, executor.map(_get_show_seasons, candidate_ids)):
+                _store_show_seasons(show_id, seasons)
+
+    # Episodes left unresolved by everything else are looked up one by one
+    # on the episode endpoint after the loop, concurrently
+    episode_lookups = []
+
+    for processed_count, (it, show_title, show_ids, _) in enumerate(episodes, start=1):
         if processed_count % 50 == 0:
-            print(f"  Processing: {processed_count}/{len(history)} items...")
-        
-        if it.get('force_type') == 'episode':
-            # prefer extracted_season if present
-            if it.get('extracted_season') is not None:
-                it['resolved_season'] = it.get('extracted_season')
-                continue
+            print(f"  Processing: {processed_count}/{len(episodes)} episodes...")
 
-            # if season present at top-level, use it
-            if it.get('season') is not None:
-                it['resolved_season'] = it.get('season')
-                continue
+        # prefer extracted_season if present
+        if it.get('extracted_season') is not None:
+            it['resolved_season'] = it.get('extracted_season')
+            continue
 
-            # try to resolve using show ids
-            show = it.get('show') or {}
-            show_ids = show.get('ids') if isinstance(show, dict) else None
-            show_trakt_id = None
-            if show_ids and isinstance(show_ids, dict):
-                show_trakt_id = show_ids.get('trakt')
+        # if season present at top-level, use it
+        if it.get('season') is not None:
+            it['resolved_season'] = it.get('season')
+            continue
 
-            if show_trakt_id:
-                if show_trakt_id not in show_cache:
-                    try:
-                        seasons = trakt_main.Trakt[f'shows/{show_trakt_id}/seasons'].get(extended='episodes')
-                    except Exception:
-                        seasons = None
-                    show_cache[show_trakt_id] = seasons
-
-                seasons = show_cache.get(show_trakt_id)
-                if seasons:
-                    found = None
-                    ep_trakt_id = it.get('ids', {}).get('trakt')
-                    for s in seasons:
-                        # seasons entries from api may include 'episodes'
-                        episodes = s.get('episodes') or []
-                        for ep in episodes:
-                            # compare IDs as strings to avoid int/str mismatches
-                            if ep_trakt_id and str(ep.get('ids', {}).get('trakt')) == str(ep_trakt_id):
-                                found = s.get('number')
-                                break
-                        if found is not None:
-                            break
-                    if found is not None:
-                        it['resolved_season'] = found
-                        continue
+        # raw API items carry the season on the nested episode
+        episode_season = (it.get('episode') or {}).get('season')
+        if episode_season is not None:
+            it['resolved_season'] = episode_season
+            continue
 
-            # If we couldn't resolve via embedded show ids, try searching Trakt by show title (public search)
-            if not show_trakt_id:
-                title = it.get('extracted_show_title') or (it.get('show') or {}).get('title')
-                if title and TRAKT_CLIENT_ID:
-                    try:
-                        q = urllib.parse.quote_plus(title)
-                        url = f"https://api.trakt.tv/search/show?query={q}"
-                        headers = {
-                            'Content-Type': 'application/json',
-                            'trakt-api-version': '2',
-                            'trakt-api-key': TRAKT_CLIENT_ID,
-                        }
-                        r = requests.get(url, headers=headers, timeout=10)
-                        if r.status_code == 200:
-                            results = r.json()
-                            if results:
-                                # try to pick the correct show from search results by
-                                # checking seasons/episodes for a matching episode id,
-                                # or matching episode title / first_aired date as fallback
-                                ep_trakt_id = it.get('ids', {}).get('trakt')
-                                ep_title = (it.get('title') or '').strip().lower()
-                                ep_first_aired = it.get('first_aired')
-                                candidate = None
-                                for res in results:
-                                    cand_id = res.get('show', {}).get('ids', {}).get('trakt')
-                                    if not cand_id:
-                                        continue
-                                    # fetch seasons for candidate if not cached
-                                    if cand_id not in show_cache:
-                                        try:
-                                            seasons_cand = trakt_main.Trakt[f'shows/{cand_id}/seasons'].get(extended='episodes')
-                                        except Exception:
-                                            seasons_cand = None
-                                        show_cache[cand_id] = seasons_cand
-
-                                    seasons_cand = show_cache.get(cand_id)
-                                    if not seasons_cand:
-                                        continue
-                                    found = False
-                                    for s in seasons_cand:
-                                        for ep in (s.get('episodes') or []):
-                                            # compare trakt ids first
-                                            if ep_trakt_id and str(ep.get('ids', {}).get('trakt')) == str(ep_trakt_id):
-                                                candidate = cand_id
-                                                found = True
-                                                break
-                                            # fallback: compare episode title
-                                            if ep_title and ep.get('title') and ep.get('title').strip().lower() == ep_title:
-                                                candidate = cand_id
-                                                found = True
-                                                break
-                                            # fallback: compare first_aired (date/time string equality)
-                                            if ep_first_aired and ep.get('first_aired') and ep.get('first_aired') == ep_first_aired:
-                                                candidate = cand_id
-                                                found = True
-                                                break
-                                        if found:
-                                            break
-                                    if candidate:
-                                        show_trakt_id = candidate
-                                        break
-                    except Exception:
-                        show_trakt_id = None
-
-                if show_trakt_id and show_trakt_id not in show_cache:
-                    try:
-                        seasons = trakt_main.Trakt[f'shows/{show_trakt_id}/seasons'].get(extended='episodes')
-                    except Exception:
-                        seasons = None
-                    show_cache[show_trakt_id] = seasons
-
-                seasons = show_cache.get(show_trakt_id)
-                if seasons:
-                    found = None
-                    ep_trakt_id = it.get('ids', {}).get('trakt')
-                    for s in seasons:
-                        episodes = s.get('episodes') or []
-                        for ep in episodes:
-                            # compare IDs as strings to avoid int/str mismatches
-                            if ep_trakt_id and str(ep.get('ids', {}).get('trakt')) == str(ep_trakt_id):
-                                found = s.get('number')
-                                break
-                        if found is not None:
-                            break
-                    if found is not None:
-                        it['resolved_season'] = found
-                        continue
+        # episode already seen in an indexed show's seasons: no request needed
+        ep_trakt_id = _episode_trakt_id(it)
+        found = episode_seasons.get(str(ep_trakt_id)) if ep_trakt_id else None
+        if found is not None:
+            it['resolved_season'] = found
+            continue
+
+        # try to resolve using show ids
+        show_trakt_id = show_ids.get('trakt') if show_ids else None
+
+        if show_trakt_id:
+            if _fetch_show_seasons(show_trakt_id):
+                found = show_ep_index[show_trakt_id].get(str(ep_trakt_id)) if ep_trakt_id else None
+                if found is not None:
+                    it['resolved_season'] = found
+                    continue
 
-            # Direct episode lookup fallback: try the public episode endpoint by trakt id
-            ep_trakt_id = it.get('ids', {}).get('trakt')
-            if ep_trakt_id and TRAKT_CLIENT_ID:
+        # If we couldn't resolve via embedded show ids, try searching Trakt by show title (public search)
+        if not show_trakt_id:
+            title = it.get('extracted_show_title') or show_title
+            if title and TRAKT_CLIENT_ID:
                 try:
-                    # public Trakt API episode lookup (requires client id header)
-                    ep_url = f"https://api.trakt.tv/episodes/{ep_trakt_id}?extended=full"
-                    headers = {
-                        'Content-Type': 'application/json',
-                        'trakt-api-version': '2',
-                        'trakt-api-key': TRAKT_CLIENT_ID,
-                    }
-                    r_ep = requests.get(ep_url, headers=headers, timeout=10)
-                    if r_ep.status_code == 200:
-                        ep_data = r_ep.json()
-                        season_num = ep_data.get('season')
-                        if season_num is not None:
-                            it['resolved_season'] = season_num
-                            continue
+                    results = title_search_results.get(title)
+                    if results:
+                        # try to pick the correct show from search results by
+                        # checking seasons/episodes for a matching episode id,
+                        # or matching episode title / first_aired date as fallback
+                        ep_title = norm_title(it.get('title'))
+                        ep_first_aired = it.get('first_aired')
+                        for cand_id in _search_candidates(title, results):
+                            # fetch seasons for candidate if not cached
+                            if not _fetch_show_seasons(cand_id):
+                                continue
+                            # compare trakt ids first, then episode title,
+                            # then first_aired (date/time string equality)
+                            if ((ep_trakt_id and str(ep_trakt_id) in show_ep_index[cand_id])
+                                    or (ep_title and ep_title in show_ep_titles[cand_id])
+                                    or (ep_first_aired and ep_first_aired in show_ep_aired[cand_id])):
+                                show_trakt_id = cand_id
+                                break
                 except Exception:
-                    # silent fallback to existing logic
-                    pass
+                    show_trakt_id = None
+
+            if show_trakt_id and _fetch_show_seasons(show_trakt_id):
+                found = show_ep_index[show_trakt_id].get(str(ep_trakt_id)) if ep_trakt_id else None
+                # the show may have been matched on episode title or air date instead
+                if found is None:
+                    found = show_ep_titles[show_trakt_id].get(norm_title(it.get('title')))
+                if found is None and it.get('first_aired'):
+                    found = show_ep_aired[show_trakt_id].get(it.get('first_aired'))
+                if found is not None:
+                    it['resolved_season'] = found
+                    continue
+
+        # fallback: leave resolved_season as None, unless the public episode
+        # endpoint (requires only the client id header) knows it
+        it['resolved_season'] = None
+        if ep_trakt_id and TRAKT_CLIENT_ID:
+            episode_lookups.append((it, ep_trakt_id))
+
+    def _lookup_episode_season(ep_trakt_id):
+        try:
+            r_ep = SESSION.get(f"https://api.trakt.tv/episodes/{ep_trakt_id}?extended=full", timeout=10)
+            if r_ep.status_code == 200:
+                return response_json(r_ep).get('season')
+        except Exception:
+            # silent fallback to existing logic
+            pass
+        return None
 
-            # fallback: leave resolved_season as None
-            it['resolved_season'] = None
+    if episode_lookups:
+        with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+            seasons = executor.map(_lookup_episode_season, [ep_trakt_id for _, ep_trakt_id in episode_lookups])
+            for (it, _), season_num in zip(episode_lookups, seasons):
+                if season_num is not None:
+                    it['resolved_season'] = season_num
 
     # inject resolved season into items before normalization
-    for it in history:
-        if it.get('force_type') == 'episode':
-            if it.get('resolved_season') is not None:
-                it['extracted_season'] = it.get('resolved_season')
+    for it, _, _, _ in episodes:
+        if it.get('resolved_season') is not None:
+            it['extracted_season'] = it.get('resolved_season')
 
     # Attach thumbnail URLs - optimized with show-level caching
     # For episodes: all episodes of the same show share the same poster (much faster)
@@ -912,66 +1230,56 @@ def main():
     # First, collect show titles that need IDs
     if not args.no_images:
         shows_needing_ids = {}
-        for it in history:
-            if it.get('force_type') == 'episode':
-                show = it.get('show') or {}
-                show_ids = show.get('ids') if isinstance(show, dict) else None
-                show_title = show.get('title') if isinstance(show, dict) else None
-                
-                # If show IDs are empty or missing, we need to fetch them
-                if show_title and (not show_ids or not show_ids.get('trakt')):
-                    if show_title not in shows_needing_ids:
-                        shows_needing_ids[show_title] = show
+        for it, show_title, show_ids, _ in episodes:
+            # If show IDs are empty or missing, we need to fetch them
+            if show_title and (not show_ids or not show_ids.get('trakt')):
+                if show_title not in shows_needing_ids:
+                    shows_needing_ids[show_title] = it['show']
         
+        # Titles searched by a recent run or by the season resolution above
+        # need no new search (see 'show_ids' in LOOKUP_CACHE_TTL)
+        for show_title in list(shows_needing_ids):
+            show_ids = _known_show_ids(show_title)
+            if show_ids is not None:
+                if show_ids:
+                    show_ids_cache[show_title] = show_ids
+                del shows_needing_ids[show_title]
+
         # Fetch show IDs for shows that don't have them
         if shows_needing_ids and TRAKT_CLIENT_ID:
             print(f"  Looking up IDs for {len(shows_needing_ids)} shows...")
-            for show_title in shows_needing_ids:
+            def lookup_ids(show_title):
                 try:
-                    q = urllib.parse.quote_plus(show_title)
-                    url = f"https://api.trakt.tv/search/show?query={q}"
-                    headers = {
-                        'Content-Type': 'application/json',
-                        'trakt-api-version': '2',
-                        'trakt-api-key': TRAKT_CLIENT_ID,
-                    }
-                    r = requests.get(url, headers=headers, timeout=10)
-                    if r.status_code == 200:
-                        results = r.json()
-                        if results:
-                            first_show = results[0].get('show', {})
-                            show_ids = first_show.get('ids', {})
-                            if show_ids:
-                                show_ids_cache[show_title] = show_ids
-                                if args.verbose:
-                                    print(f"  Found IDs for '{show_title}': {show_ids}")
+                    return show_title, search_show(show_title).get('ids', {}), None
                 except Exception as e:
-                    if args.verbose:
-                        print(f"  Failed to fetch IDs for '{show_title}': {e}")
-        
+                    return show_title, None, e
+
+            with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+                for show_title, show_ids, error in executor.map(lookup_ids, shows_needing_ids):
+                    if error is not None:
+                        if args.verbose:
+                            print(f"  Failed to fetch IDs for '{show_title}': {error}")
+                        continue
+                    _store_show_ids(show_title, show_ids)
+                    if show_ids:
+                        show_ids_cache[show_title] = show_ids
+                        if args.verbose:
+                            print(f"  Found IDs for '{show_title}': {show_ids}")
+
         # Update the original history items with fetched show IDs so they get cached
         if show_ids_cache:
             print(f"  Updating {len(show_ids_cache)} shows with fetched IDs in cache...")
-            for it in history:
-                if it.get('force_type') == 'episode':
-                    show = it.get('show') or {}
-                    show_title = show.get('title') if isinstance(show, dict) else None
-                    if show_title and show_title in show_ids_cache:
-                        # Update the show's IDs in the history item
-                        if not isinstance(it.get('show'), dict):
-                            it['show'] = {}
-                        it['show']['ids'] = show_ids_cache[show_title]
+            for it, show_title, _, _ in episodes:
+                if show_title and show_title in show_ids_cache:
+                    # Update the show's IDs in the history item
+                    it['show']['ids'] = show_ids_cache[show_title]
     
     # Build RPDB URLs
-    for it in history:
-        thumb = None
-        
+    if not args.no_images and RPDB_API_KEY:
         # For episodes, build and cache show poster URL
-        if it.get('force_type') == 'episode' and not args.no_images and RPDB_API_KEY:
-            show = it.get('show') or {}
-            show_title = show.get('title') if isinstance(show, dict) else None
-            show_ids = show.get('ids') if isinstance(show, dict) else None
-            
+        for it, show_title, show_ids, _ in episodes:
+            thumb = None
+
             # Use cached IDs if we fetched them
             if show_title and show_title in show_ids_cache:
                 show_ids = show_ids_cache[show_title]
@@ -983,310 +1291,279 @@ def main():
                 thumb = show_poster_cache[show_trakt_id]
             elif show_ids:
                 # Build RPDB URL from show IDs (prioritize TVDB for TV shows)
-                tvdb_id = show_ids.get('tvdb')
-                imdb_id = show_ids.get('imdb')
-                tmdb_id = show_ids.get('tmdb')
-                
-                if tvdb_id:
-                    thumb = f'https://api.ratingposterdb.com/{RPDB_API_KEY}/tvdb/poster-default/{tvdb_id}.jpg?fallback=true'
-                elif imdb_id:
-                    thumb = f'https://api.ratingposterdb.com/{RPDB_API_KEY}/imdb/poster-default/{imdb_id}.jpg?fallback=true'
-                elif tmdb_id:
-                    thumb = f'https://api.ratingposterdb.com/{RPDB_API_KEY}/tmdb/poster-default/series-{tmdb_id}.jpg?fallback=true'
-                
+                thumb = rpdb_poster_url(RPDB_API_KEY, show_ids, SHOW_POSTER_ID_KEYS, 'series')
+
                 # Cache for reuse
                 if show_trakt_id and thumb:
                     show_poster_cache[show_trakt_id] = thumb
+
+            if thumb:
+                it['thumbnail'] = thumb
         
         # For movies, build RPDB URL from movie IDs
-        elif it.get('force_type') == 'movie' and not args.no_images and RPDB_API_KEY:
+        for it in movies:
+            thumb = None
             movie = it.get('movie') or it
             ids = movie.get('ids') if isinstance(movie, dict) else None
             if ids and isinstance(ids, dict):
-                imdb_id = ids.get('imdb')
-                tmdb_id = ids.get('tmdb')
-                tvdb_id = ids.get('tvdb')
-                
-                if imdb_id:
-                    thumb = f'https://api.ratingposterdb.com/{RPDB_API_KEY}/imdb/poster-default/{imdb_id}.jpg?fallback=true'
-                elif tmdb_id:
-                    thumb = f'https://api.ratingposterdb.com/{RPDB_API_KEY}/tmdb/poster-default/movie-{tmdb_id}.jpg?fallback=true'
-                elif tvdb_id:
-                    thumb = f'https://api.ratingposterdb.com/{RPDB_API_KEY}/tvdb/poster-default/{tvdb_id}.jpg?fallback=true'
-                
+                thumb = rpdb_poster_url(RPDB_API_KEY, ids, MOVIE_POSTER_ID_KEYS, 'movie')
+
                 if args.verbose and thumb:
                     print(f'Movie poster: {thumb}')
 
-        if thumb:
-            it['thumbnail'] = thumb
+            if thumb:
+                it['thumbnail'] = thumb
     
     print(f"  Cached {len(show_poster_cache)} unique show posters")
 
     # Enrich episodes with show details (genres and year)
-    # Build a show title to trakt_id mapping for episodes
+    # Show searches, details and cast lists are reused across runs (see LOOKUP_CACHE_TTL)
+    people_cache = lookup_cache.setdefault('people', {})
+    details_cache = lookup_cache.setdefault('shows', {})
+
+    def fetch_cast(kind, trakt_id):
+        """Top five cast names for a movie or show ('movies'/'shows'), None on failure."""
+        try:
+            r = SESSION.get(f'https://api.trakt.tv/{kind}/{trakt_id}/people', timeout=10)
+            if r.status_code == 404:
+                return []
+            if r.status_code != 200:
+                return None
+            cast = response_json(r).get('cast') or []
+            return [name for c in islice(cast, 5) if (name := (c.get('person') or {}).get('name'))]
+        except Exception as e:
+            if args.verbose:
+                print(f"  Error fetching cast for {kind} {trakt_id}: {e}")
+            return None
+
+    def store_cast(kind, trakt_id, top_cast):
+        """Record a fetch_cast() result for this run and, when it succeeded, in the lookup cache."""
+        nonlocal lookup_cache_dirty
+        (movie_cast if kind == 'movies' else show_cast)[trakt_id] = top_cast or []
+        if top_cast is not None:
+            people_cache[f'{kind}/{trakt_id}'] = [time.time(), top_cast]
+            lookup_cache_dirty = True
+
+    # Build a show title to trakt_id mapping for episodes (also used for cast)
+    show_title_to_id = {}
     if not getattr(args, 'no_enrichment', False):
         print("\n=== Enriching episodes with show metadata ===")
-        show_title_to_id = {}
-        for it in history:
-            if it.get('force_type') == 'episode':
-                show = it.get('show') or {}
-                show_title = show.get('title') if isinstance(show, dict) else None
-                if not show_title:
-                    show_title = it.get('extracted_show_title')
-                
-                if show_title and show_title not in show_title_to_id:
-                    # Try to search for the show to get its trakt ID
-                    if TRAKT_CLIENT_ID:
-                        try:
-                            q = urllib.parse.quote_plus(show_title)
-                            url = f"https://api.trakt.tv/search/show?query={q}"
-                            headers = {
-                                'Content-Type': 'application/json',
-                                'trakt-api-version': '2',
-                                'trakt-api-key': TRAKT_CLIENT_ID,
-                            }
-                            r = requests.get(url, headers=headers, timeout=10)
-                            if r.status_code == 200:
-                                results = r.json()
-                                if results:
-                                    # Take the first result (best match)
-                                    first_show = results[0].get('show', {})
-                                    show_trakt_id = first_show.get('ids', {}).get('trakt')
-                                    if show_trakt_id:
-                                        show_title_to_id[show_title] = show_trakt_id
-                        except Exception:
-                            pass
-        
-        # Now fetch show details for all discovered show IDs
-        for show_trakt_id in show_title_to_id.values():
-            if show_trakt_id not in show_details:
+        show_titles = dict.fromkeys(
+            show_key for _, _, _, show_key in episodes if show_key
+        )
+
+        # Shows whose ids are already known (from the history itself or the
+        # image lookups above) need no search
+        for _, _, show_ids, show_key in episodes:
+            if show_key in show_titles and show_key not in show_title_to_id:
+                known_id = (show_ids or show_ids_cache.get(show_key) or {}).get('trakt')
+                if known_id:
+                    show_title_to_id[show_key] = known_id
+
+        # Search for each remaining show's trakt ID concurrently (first result
+        # is the best match), skipping titles resolved by a recent run or
+        # already searched for season resolution
+        to_search = []
+        for show_title in show_titles:
+            if show_title in show_title_to_id:
+                continue
+            show_ids = _known_show_ids(show_title)
+            if show_ids is None:
+                to_search.append(show_title)
+            elif show_ids.get('trakt'):
+                show_title_to_id[show_title] = show_ids['trakt']
+        if to_search and TRAKT_CLIENT_ID:
+            def lookup_show_ids(show_title):
                 try:
-                    show_obj = trakt_main.Trakt[f'shows/{show_trakt_id}'].get(extended='full,images')
-                    # Convert Trakt Show object to dict
-                    if hasattr(show_obj, 'to_dict'):
-                        sd = show_obj.to_dict()
-                    elif hasattr(show_obj, '__dict__'):
-                        sd = vars(show_obj)
-                    else:
-                        sd = dict(show_obj) if show_obj else {}
-                    show_details[show_trakt_id] = sd
+                    return True, search_show(show_title).get('ids', {})
                 except Exception:
-                    show_details[show_trakt_id] = None
-        
-        # Finally, enrich episodes with show metadata
-        enriched_count = 0
-        for it in history:
-            if it.get('force_type') == 'episode':
-                show = it.get('show') or {}
-                show_title = show.get('title') if isinstance(show, dict) else None
-                if not show_title:
-                    show_title = it.get('extracted_show_title')
-                
-                show_trakt_id = show_title_to_id.get(show_title) if show_title else None
-                if show_trakt_id and show_trakt_id in show_details:
-                    sd = show_details.get(show_trakt_id) or {}
-                    if isinstance(sd, dict):
-                        # Add genres from show details
-                        if sd.get('genres') and not it.get('genres'):
-                            it['genres'] = sd.get('genres')
-                            enriched_count += 1
-                        # Add year from show details
-                        if sd.get('year') and not it.get('year'):
-                            it['year'] = sd.get('year')
-                        # Update show object with genres and year for normalization
-                        if not isinstance(it.get('show'), dict):
-                            it['show'] = {}
-                        it['show']['genres'] = sd.get('genres')
-                        it['show']['year'] = sd.get('year')
+                    return False, None
+
+            with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+                for show_title, (ok, show_ids) in zip(to_search, executor.map(lookup_show_ids, to_search)):
+                    if ok:
+                        _store_show_ids(show_title, show_ids)
+                    if show_ids and show_ids.get('trakt'):
+                        show_title_to_id[show_title] = show_ids['trakt']
         
-        print(f"  Enriched {enriched_count} episodes with show metadata")
+        # Now fetch show details once per discovered show ID. Each show's cast
+        # needs its own /people request: start those (for shows not already in
+        # the lookup cache) so they run alongside the details requests.
+        enriched_show_ids = set(show_title_to_id.values())
+        cast_show_ids = [] if getattr(args, 'no_cast', False) or not TRAKT_CLIENT_ID else [
+            show_id for show_id in enriched_show_ids if f'shows/{show_id}' not in people_cache
+        ]
+        def fetch_show_details(show_trakt_id):
+            try:
+                r = SESSION.get(f'https://api.trakt.tv/shows/{show_trakt_id}',
+                                params={'extended': 'full,images'}, timeout=10)
+                return response_json(r) if r.ok else None
+            except Exception:
+                return None
+
+        # Genres and year fetched by a recent run are reused as-is
+        detail_ids = []
+        for show_id in enriched_show_ids:
+            if show_id in show_details:
+                continue
+            entry = details_cache.get(str(show_id))
+            if entry:
+                show_details[show_id] = entry[1]
+            elif TRAKT_CLIENT_ID:
+                detail_ids.append(show_id)
+        with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+            cast_results = executor.map(lambda show_id: fetch_cast('shows', show_id), cast_show_ids)
+            now = time.time()
+            for show_trakt_id, sd in zip(detail_ids, executor.map(fetch_show_details, detail_ids)):
+                show_details[show_trakt_id] = sd
+                if isinstance(sd, dict):
+                    details_cache[str(show_trakt_id)] = [now, {'genres': sd.get('genres'), 'year': sd.get('year')}]
+                    lookup_cache_dirty = True
+            for show_id, top_cast in zip(cast_show_ids, cast_results):
+                store_cast('shows', show_id, top_cast)
     else:
         print("\n=== Skipping show enrichment (--no-enrichment) ===")
 
     # Fetch cast/actors for movies and shows (optional - can be disabled with --no-cast flag)
     if not getattr(args, 'no_cast', False):
         print("\n=== Fetching cast information ===")
-        headers = {
-            'Content-Type': 'application/json',
-            'trakt-api-version': '2',
-            'trakt-api-key': TRAKT_CLIENT_ID
-        }
-        
-        # Count unique items to fetch
-        unique_movies = set()
-        unique_shows = set()
-        for it in history:
-            if it.get('force_type') == 'movie':
-                movie_id = it.get('ids', {}).get('trakt')
-                if movie_id and movie_id not in movie_cast:
-                    unique_movies.add(movie_id)
-            elif it.get('force_type') == 'episode':
-                show = it.get('show') or {}
-                show_title = show.get('title') if isinstance(show, dict) else None
-                if not show_title:
-                    show_title = it.get('extracted_show_title')
-                show_id = show_title_to_id.get(show_title) if show_title else None
-                if show_id and show_id not in show_cast:
-                    unique_shows.add(show_id)
+        # Unique ids to fetch: every movie once, and every show once (show_title_to_id
+        # was built from the titles of the episodes being processed)
+        unique_movies = {
+            it.get('ids', {}).get('trakt') for it in movies if it.get('ids', {}).get('trakt')
+        } - movie_cast.keys()
+        unique_shows = set(show_title_to_id.values()) - show_cast.keys()
+
+        # Cast lists fetched by a recent run are reused as-is
+        for cast_by_id, ids, kind in ((movie_cast, unique_movies, 'movies'), (show_cast, unique_shows, 'shows')):
+            for trakt_id in list(ids):
+                entry = people_cache.get(f'{kind}/{trakt_id}')
+                if entry:
+                    cast_by_id[trakt_id] = entry[1]
+                    ids.discard(trakt_id)
         
+        # /people needs the client id headers; without them only cached casts are used
+        if not TRAKT_CLIENT_ID:
+            unique_movies.clear()
+            unique_shows.clear()
+
         print(f"Fetching cast for {len(unique_movies)} movies and {len(unique_shows)} shows...")
         
-        fetched_movies = 0
-        fetched_shows = 0
-        for it in history:
-            if it.get('force_type') == 'movie':
-                movie_trakt_id = it.get('ids', {}).get('trakt')
-                if movie_trakt_id and movie_trakt_id not in movie_cast:
-                    try:
-                        url = f'https://api.trakt.tv/movies/{movie_trakt_id}/people'
-                        r = requests.get(url, headers=headers, timeout=10)
-                        if r.status_code == 200:
-                            data = r.json()
-                            cast_list = data.get('cast', [])
-                            top_cast = []
-                            for c in cast_list[:5]:
-                                person = c.get('person', {})
-                                name = person.get('name')
-                                if name:
-                                    top_cast.append(name)
-                            movie_cast[movie_trakt_id] = top_cast
-                            fetched_movies += 1
-                            if fetched_movies % 10 == 0:
-                                print(f"  Progress: {fetched_movies}/{len(unique_movies)} movies")
-                        else:
-                            movie_cast[movie_trakt_id] = []
-                    except Exception as e:
-                        movie_cast[movie_trakt_id] = []
-                        if args.verbose:
-                            print(f"  Error fetching cast for movie {movie_trakt_id}: {e}")
-            
-            elif it.get('force_type') == 'episode':
-                show = it.get('show') or {}
-                show_title = show.get('title') if isinstance(show, dict) else None
-                if not show_title:
-                    show_title = it.get('extracted_show_title')
-                
-                show_trakt_id = show_title_to_id.get(show_title) if show_title else None
-                if show_trakt_id and show_trakt_id not in show_cast:
-                    try:
-                        url = f'https://api.trakt.tv/shows/{show_trakt_id}/people'
-                        r = requests.get(url, headers=headers, timeout=10)
-                        if r.status_code == 200:
-                            data = r.json()
-                            cast_list = data.get('cast', [])
-                            top_cast = []
-                            for c in cast_list[:5]:
-                                person = c.get('person', {})
-                                name = person.get('name')
-                                if name:
-                                    top_cast.append(name)
-                            show_cast[show_trakt_id] = top_cast
-                            fetched_shows += 1
-                            if fetched_shows % 5 == 0:
-                                print(f"  Progress: {fetched_shows}/{len(unique_shows)} shows")
-                        else:
-                            show_cast[show_trakt_id] = []
-                    except Exception as e:
-                        show_cast[show_trakt_id] = []
-                        if args.verbose:
-                            print(f"  Error fetching cast for show {show_trakt_id}: {e}")
-
-        # Add cast to items
-        print("\n=== Adding cast to items ===")
-        cast_added = 0
-        for it in history:
-            if it.get('force_type') == 'movie':
-                movie_trakt_id = it.get('ids', {}).get('trakt')
-                if movie_trakt_id and movie_trakt_id in movie_cast:
-                    it['cast'] = movie_cast[movie_trakt_id]
-                    if movie_cast[movie_trakt_id]:
-                        cast_added += 1
-            elif it.get('force_type') == 'episode':
-                show = it.get('show') or {}
-                show_title = show.get('title') if isinstance(show, dict) else None
-                if not show_title:
-                    show_title = it.get('extracted_show_title')
-                
-                show_trakt_id = show_title_to_id.get(show_title) if show_title else None
-                if show_trakt_id and show_trakt_id in show_cast:
-                    it['cast'] = show_cast[show_trakt_id]
-                    if show_cast[show_trakt_id]:
-                        cast_added += 1
-        
-        print(f"Added cast to {cast_added} items")
+        # People lookups are independent, so run them concurrently
+        with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+            movie_results = executor.map(lambda movie_id: fetch_cast('movies', movie_id), unique_movies)
+            for fetched, (movie_id, top_cast) in enumerate(zip(unique_movies, movie_results), start=1):
+                store_cast('movies', movie_id, top_cast)
+                if fetched % 10 == 0:
+                    print(f"  Progress: {fetched}/{len(unique_movies)} movies")
+
+            show_results = executor.map(lambda show_id: fetch_cast('shows', show_id), unique_shows)
+            for fetched, (show_id, top_cast) in enumerate(zip(unique_shows, show_results), start=1):
+                store_cast('shows', show_id, top_cast)
+                if fetched % 5 == 0:
+                    print(f"  Progress: {fetched}/{len(unique_shows)} shows")
     else:
         print("\n=== Skipping cast fetch (--no-cast flag) ===")
 
-    # Normalize newly processed items
-    simplified_new = [normalize(i) for i in history]
-    if username == PRIMARY_USER and user_ratings:
-        for item in simplified_new:
-            _apply_rating_to_item(item)
+    # Attach show metadata and cast in a single pass over the processed items
+    enrich_shows = not getattr(args, 'no_enrichment', False)
+    add_cast = not getattr(args, 'no_cast', False)
+    enriched_count = 0
+    cast_added = 0
+    if add_cast:
+        for it in movies:
+            movie_trakt_id = it.get('ids', {}).get('trakt')
+            if movie_trakt_id and movie_trakt_id in movie_cast:
+                it['cast'] = movie_cast[movie_trakt_id]
+                if it['cast']:
+                    cast_added += 1
+    if enrich_shows or add_cast:
+        for it, _, _, show_key in episodes:
+            show_trakt_id = show_title_to_id.get(show_key) if show_key else None
+            if enrich_shows and show_trakt_id in show_details:
+                sd = show_details.get(show_trakt_id) or {}
+                # Add genres and year from show details
+                if sd.get('genres') and not it.get('genres'):
+                    it['genres'] = sd.get('genres')
+                    enriched_count += 1
+                if sd.get('year') and not it.get('year'):
+                    it['year'] = sd.get('year')
+                # Update show object with genres and year for normalization
+                if not isinstance(it.get('show'), dict):
+                    it['show'] = {}
+                it['show']['genres'] = sd.get('genres')
+                it['show']['year'] = sd.get('year')
+            if add_cast and show_trakt_id in show_cast:
+                it['cast'] = show_cast[show_trakt_id]
+                if it['cast']:
+                    cast_added += 1
+    if enrich_shows:
+        print(f"  Enriched {enriched_count} episodes with show metadata")
+    if add_cast:
+        print(f"Added cast to {cast_added} items")
+
+    if lookup_cache_dirty:
+        try:
+            save_lookup_cache(lookup_cache_path, lookup_cache)
+        except OSError as e:
+            print(f"  Could not write {lookup_cache_path}: {e}")
+
+    # Normalize newly processed items. This stays a list: the merge below
+    # needs the new items' keys before any cached item is kept, and the output
+    # header's count is written before the items are streamed.
+    simplified = [normalize(i) for i in history]
+    new_count = len(simplified)
     
-    # Load previously processed items from output cache if available
-    simplified = simplified_new
-    if cached_items and len(new_items) < len(deduped):
+    # Merge in previously processed items from the output cache
+    if cached_processed_items is not None and len(new_items) < len(deduped):
         # We have cached items - need to merge
-        print(f"\n=== Merging {len(simplified_new)} new processed items with cache ===")
+        print(f"\n=== Merging {new_count} new processed items with cache ===")
         
-        # Load the existing processed output
-        if os.path.exists(OUT_PATH):
-            try:
-                with open(OUT_PATH, 'r') as f:
-                    cached_output = json.load(f)
-                    cached_processed_items = cached_output.get('items', [])
-                
-                # Build a set of keys from new items to avoid duplicates
-                new_item_keys = set()
-                for item in simplified_new:
-                    # Use same key logic as deduplication
-                    trakt_id = (item.get('ids') or {}).get('trakt')
-                    key_id = str(trakt_id) if trakt_id else (item.get('title') or '')
-                    watched_day = str(item.get('watched_at') or '')[:10]
-                    key = (item.get('type'), key_id, watched_day)
-                    new_item_keys.add(key)
-                
-                # Merge: new items + cached items (excluding any that are in new)
-                simplified = simplified_new.copy()
-                for cached_item in cached_processed_items:
-                    trakt_id = (cached_item.get('ids') or {}).get('trakt')
-                    key_id = str(trakt_id) if trakt_id else (cached_item.get('title') or '')
-                    watched_day = str(cached_item.get('watched_at') or '')[:10]
-                    key = (cached_item.get('type'), key_id, watched_day)
-                    
-                    if key not in new_item_keys:
-                        if username == PRIMARY_USER and user_ratings:
-                            _apply_rating_to_item(cached_item)
-                        simplified.append(cached_item)
-                
-                print(f"  Total items after merge: {len(simplified)} ({len(simplified_new)} new + {len(simplified) - len(simplified_new)} cached)")
-            except Exception as e:
-                print(f"  Warning: Could not load cached processed items: {e}")
-                print(f"  Using only newly processed items")
-                simplified = simplified_new
+        # Mirrors _dedupe_key on the processed fields: (type, trakt id or
+        # title, SxE for episodes, local watched day), so different episodes
+        # of a show watched on the same day are never merged
+        def _output_key(item):
+            trakt_id = (item.get('ids') or {}).get('trakt')
+            episode_identifier = None
+            if item.get('type') == 'episode' and item.get('number') is not None:
+                episode_identifier = f"S{item.get('season')}E{item.get('number')}"
+            return (
+                item.get('type'),
+                trakt_id if trakt_id else (item.get('title') or ''),
+                episode_identifier,
+                str(item.get('watched_at') or '')[:10],
+            )
+
+        # Merge: new items + previously processed items (excluding any that are in new)
+        new_item_keys = {_output_key(item) for item in simplified}
+        simplified.extend(
+            cached_item for cached_item in cached_processed_items
+            if _output_key(cached_item) not in new_item_keys
+        )
+        
+        print(f"  Total items after merge: {len(simplified)} ({new_count} new + {len(simplified) - new_count} cached)")
     
-    # Refresh ratings on all processed items (new + cached) every run
-    # Apply ratings twice to ensure they're picked up even if trakt ID lookup fails on first pass
-    if username == PRIMARY_USER and user_ratings:
-        ratings_updated = 0
-        for item in simplified:
+    # Ratings are refreshed on every item (new + cached) as it is written out
+    ratings_updated = 0
+
+    def rated_items():
+        nonlocal ratings_updated
+        for position, item in enumerate(simplified):
             old_rating = item.get('rating')
             _apply_rating_to_item(item)
-            if old_rating != item.get('rating'):
+            if position >= new_count and old_rating != item.get('rating'):
                 ratings_updated += 1
-        if ratings_updated > 0:
-            print(f"\n✓ Updated ratings on {ratings_updated} items during merge")
+            yield item
 
     os.makedirs(os.path.dirname(OUT_PATH), exist_ok=True)
     
     end_time = datetime.now()
     generation_time_seconds = (end_time - start_time).total_seconds()
     
-    out = {
+    out_header = {
         'generated_at': datetime.now().isoformat(),
         'generation_time': round(generation_time_seconds, 2),
         'count': len(simplified),
-        'items': simplified
     }
     
     # Write all files at once (minimize disk I/O for slow SD cards)
@@ -1294,18 +1571,61 @@ def main():
     os.makedirs(os.path.dirname(OUT_PATH), exist_ok=True)
     os.makedirs(os.path.dirname(RAW_PATH), exist_ok=True)
     
-    # Write raw data first (for caching) - save ALL deduped items (new + cached)
-    with open(RAW_PATH, 'w') as f:
-        json.dump(deduped, f, indent=2)
-    print(f'Wrote raw data: {RAW_PATH}')
+    # Write raw data first (for caching) - save ALL deduped items (new + cached).
+    # A digest of the last write is kept next to it so an unchanged cache
+    # (the common case for incremental runs) is not rewritten.
+    # The raw cache is only read back by this script, so it is written compact
+    raw_bytes = dump_json(deduped, indent=args.pretty_raw)
+    raw_hash = content_hash(raw_bytes)
+    raw_hash_path = RAW_PATH + '.hash'
+    try:
+        with open(raw_hash_path, 'r') as f:
+            old_raw_hash = f.read().strip()
+    except OSError:
+        old_raw_hash = None
+    def write_raw():
+        if old_raw_hash == raw_hash and os.path.exists(RAW_PATH):
+            return f'Raw data unchanged, kept: {RAW_PATH}'
+        write_atomic(RAW_PATH, raw_bytes)
+        write_atomic(raw_hash_path, raw_hash.encode('ascii'))
+        return f'Wrote raw data: {RAW_PATH}'
     
-    # Write processed output
-    with open(OUT_PATH, 'w') as f:
-        json.dump(out, f, indent=2)
+    # Write processed output, item by item, together with the compressed copy
+    # served by the web app's /api/history to gzip-capable clients. The raw
+    # cache is written on a worker thread meanwhile, as file writes release the GIL.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        raw_write = executor.submit(write_raw)
+        write_with_gzip(OUT_PATH, iter_history_json(out_header, rated_items(), indent=args.pretty))
+        print(raw_write.result())
     print(f'Wrote processed data: {OUT_PATH}')
+    print(f'Wrote compressed data: {OUT_PATH}.gz')
+    if ratings_updated > 0:
+        print(f"✓ Updated ratings on {ratings_updated} cached items")
     
     print(f'Generation time: {generation_time_seconds:.2f} seconds')
 
 
+# /refresh and the scheduler run updates in the same process; a user's updates
+# are serialized so two runs never write the same raw and output files at once
+_USER_LOCKS = {}
+_USER_LOCKS_GUARD = threading.Lock()
+
+def run_update_for_user(username, *extra_args, wait=True):
+    """Run the updater for a single user in-process (used by the web app's /refresh and the scheduler).
+
+    With wait=False nothing is run while another update for the user is still
+    in progress. Returns False in that case, True once the update has run.
+    """
+    with _USER_LOCKS_GUARD:
+        user_lock = _USER_LOCKS.setdefault(username, threading.Lock())
+    if not user_lock.acquire(blocking=wait):
+        return False
+    try:
+        main(['--user', username, *extra_args])
+    finally:
+        user_lock.release()
+    return True
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Trakt client credentials and token file location.
+Shared by main.py and authenticate.py; importing it only reads .env.
+"""
+import os
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(BASE_DIR, '.env'))
+
+TOKEN_FILE = os.path.join(BASE_DIR, 'trakt.json')
+CLIENT_ID = os.getenv('TRAKT_CLIENT_ID')
+CLIENT_SECRET = os.getenv('TRAKT_CLIENT_SECRET')
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Shared, in-process copy of scripts/update_trakt_local.py.
+
+The web app's /refresh and the background scheduler both import UPDATER from
+here, so the updater (with its HTTP session and Trakt rate limiter) is loaded
+once per process.
+"""
+
+import os
+import logging
+import importlib.util
+
+logger = logging.getLogger(__name__)
+
+UPDATER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'update_trakt_local.py')
+
+
+def _load_updater():
+    """Import update_trakt_local.py, or return None if it is missing or fails to load."""
+    if not os.path.exists(UPDATER_PATH):
+        logger.error(f"✗ Update script not found: {UPDATER_PATH}")
+        return None
+    try:
+        spec = importlib.util.spec_from_file_location('update_trakt_local', UPDATER_PATH)
+        updater = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(updater)
+        return updater
+    except (Exception, SystemExit) as e:
+        logger.exception(f"✗ Failed to load update script {UPDATER_PATH}: {e}")
+        return None
+
+
+UPDATER = _load_updater()